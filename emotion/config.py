@@ -29,6 +29,16 @@ class Config:
     ANALYSIS_INTERVAL = 2.0  # 秒，分析间隔
     AUDIO_CHUNK_DURATION = 3.0  # 秒，音频分析块长度
     VIDEO_FRAME_RATE = 1  # 每秒分析帧数
+    # 每处理多少帧/音频块清理一次GPU缓存（缓解不同分辨率输入造成的显存碎片），0 表示关闭
+    EMPTY_CACHE_INTERVAL = int(os.environ.get('AI_EMPTY_CACHE_INTERVAL') or 64)
+    # cuDNN 确定性算法（结果可复现，但关闭自动调优、速度较慢）
+    CUDNN_DETERMINISTIC = os.environ.get('AI_CUDNN_DETERMINISTIC', '').lower() in ('1', 'true', 'yes')
+    # 观察到超过该数量的不同帧尺寸后关闭 cudnn.benchmark（输入尺寸多变时自动调优会反复触发）
+    CUDNN_BENCHMARK_MAX_SHAPES = 3
+    # 视频情绪推理批大小（与 rtsp_consumer 跨流汇集的批大小读取同一环境变量），也是 DeepFace 批量分析的并发线程数
+    INFER_BATCH = max(1, int(os.environ.get('AI_INFER_BATCH') or 4))
+    # GPU显存使用率告警阈值（百分比）
+    GPU_MEMORY_ALERT_PERCENT = float(os.environ.get('AI_GPU_MEMORY_ALERT_PERCENT') or 90.0)
     
     # WebSocket配置
     SOCKETIO_ASYNC_MODE = 'threading'
@@ -21,6 +21,21 @@ logger = logging.getLogger(__name__)
 contract_bp = Blueprint('contract_api', __name__, url_prefix='/api')
 
 
+def _invalidate_rtsp_mapping(stream_name: Optional[str]) -> None:
+    """学生会话创建/结束后，通知对应的 RTSP 消费者立即重新查询 stream_name -> 会话映射"""
+    if not stream_name:
+        return
+    import sys
+    for name in ('app_lan', 'emotion.app_lan', '__main__'):
+        rtsp_manager = getattr(sys.modules.get(name), 'rtsp_manager', None)
+        if rtsp_manager is not None:
+            try:
+                rtsp_manager.invalidate_mapping(stream_name)
+            except Exception as e:
+                logger.warning(f"[Contract API] 刷新RTSP映射失败: {e}")
+            return
+
+
 # 统一 /api/health 返回格式（即便主应用定义了同路径，也在此拦截并返回契约格式）
 @contract_bp.before_app_request
 def _enforce_contract_health():
@@ -110,7 +125,7 @@ def create_session():
             from utils.data_manager import DataManager
             data_manager = DataManager()
             session_data = data_manager.create_session(session_id)
-            session_data.update({
+            session_meta = {
                 'session_id': session_id,
                 'participant_id': participant_id,
                 'student_id': participant_id,
@@ -119,8 +134,9 @@ def create_session():
                 'stream_name': stream_name,
                 'status': 'active',
                 'started_at': ContractDataAdapter.to_iso8601_utc(datetime.now(timezone.utc))
-            })
-            data_manager.save_session(session_data)
+            }
+            session_data.update(session_meta)
+            data_manager.update_session(session_id, lambda s: s.update(session_meta))
             logger.info(f"✅ DataManager创建会话: {session_id[:8]}..., exam_id: {exam_id}")
         except Exception as e:
             logger.warning(f"⚠️ DataManager创建失败: {e}, 使用基础会话数据")
@@ -190,7 +206,8 @@ def create_session():
                 total = '?'
             logger.info(f"✅ 学生会话注册成功: {session_id[:8]}..., 总数: {total}")
 
-            # 同步为 RTSP 映射（通过 shared_sessions 与 app_lan 使用同一对象即可）
+            # 同步为 RTSP 映射（通过 shared_sessions 与 app_lan 使用同一对象），并让消费者立即重新查询
+            _invalidate_rtsp_mapping(stream_name)
 
             # 注意：不再重复保存文件，避免覆盖DataManager的完整数据
             # DataManager已经保存了包含statistics字段的完整会话数据
@@ -256,8 +273,6 @@ def end_session():
         # 加载/补全会话数据
         from utils.data_manager import DataManager
         dm = DataManager()
-        session_data = dm.load_session(session_id) or {}
-
         # 若文件缺失，尽量从共享 student_sessions 中补全 exam_id 等元数据
         try:
             from flask import current_app, has_app_context
@@ -288,34 +303,38 @@ def end_session():
             meta = {}
 
         # 写入/更新关键字段
-        session_data.setdefault('session_id', session_id)
-        if exam_result_id:
-            session_data['exam_result_id'] = exam_result_id
-        # 兼容字段：participant_id / student_id
-        if 'participant_id' not in session_data and 'student_id' in session_data:
-            session_data['participant_id'] = session_data.get('student_id')
-        # 尽可能补全 exam_id
-        if not session_data.get('exam_id') and meta.get('exam_id'):
-            session_data['exam_id'] = meta.get('exam_id')
-        
-        # 防御性检查：确保statistics字段存在，避免end_session时出错
-        if 'statistics' not in session_data:
-            logger.warning(f"⚠️ 会话 {session_id} 缺少statistics字段，添加默认值")
-            session_data['statistics'] = {
-                'total_audio_analyses': 0,
-                'total_video_analyses': 0,
-                'total_heart_rate_readings': 0,
-                'dominant_audio_emotion': None,
-                'dominant_video_emotion': None,
-                'average_heart_rate': 0.0,
-                'heart_rate_range': {'min': 0, 'max': 0},
-                'audio_emotion_distribution': {},
-                'video_emotion_distribution': {},
-                'duration_seconds': 0.0
-            }
-
-        # 先保存一次，确保 exam_result_id 写入文件
-        dm.save_session(session_data)
+        def _fill(session_data):
+            session_data.setdefault('session_id', session_id)
+            if exam_result_id:
+                session_data['exam_result_id'] = exam_result_id
+            # 兼容字段：participant_id / student_id
+            if 'participant_id' not in session_data and 'student_id' in session_data:
+                session_data['participant_id'] = session_data.get('student_id')
+            # 尽可能补全 exam_id
+            if not session_data.get('exam_id') and meta.get('exam_id'):
+                session_data['exam_id'] = meta.get('exam_id')
+            
+            # 防御性检查：确保statistics字段存在，避免end_session时出错
+            if 'statistics' not in session_data:
+                logger.warning(f"⚠️ 会话 {session_id} 缺少statistics字段，添加默认值")
+                session_data['statistics'] = {
+                    'total_audio_analyses': 0,
+                    'total_video_analyses': 0,
+                    'total_heart_rate_readings': 0,
+                    'dominant_audio_emotion': None,
+                    'dominant_video_emotion': None,
+                    'average_heart_rate': 0.0,
+                    'heart_rate_range': {'min': 0, 'max': 0},
+                    'audio_emotion_distribution': {},
+                    'video_emotion_distribution': {},
+                    'duration_seconds': 0.0
+                }
+
+        # 先写入一次，确保 exam_result_id 写入文件（在缓存中原地更新，不覆盖并发写入的事件）；会话缺失时新建
+        if not dm.update_session(session_id, _fill):
+            session_data = {}
+            _fill(session_data)
+            dm.save_session(session_data)
 
         # 结束会话（内部会标记 stopped 与 end_time，并尝试触发 finalize 回调）
         ok = dm.end_session(session_id)
@@ -357,6 +376,9 @@ def end_session():
                     if shared_streams.pop(session_id, None) is not None:
                         logger.info(f"[Contract API] 已从student_streams移除会话: {session_id}")
 
+                # 映射已移除，消费者立即重新查询（流仍在推送时不再把结果记到已结束的会话）
+                _invalidate_rtsp_mapping(session_snapshot.get('stream_name'))
+
                 # 停止RTSP流消费
                 if 'stream_name' in session_snapshot:
                     stream_name = session_snapshot.get('stream_name')
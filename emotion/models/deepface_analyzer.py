@@ -3,9 +3,11 @@ DeepFace面部情绪分析模块
 基于https://github.com/serengil/deepface项目
 """
 
+import atexit
 import numpy as np
 import cv2
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Optional, Any
 from config import Config
 import logging
@@ -24,6 +26,9 @@ class DeepFaceAnalyzer:
         self.is_initialized = False
         self.deepface_available = False
         self.face_cascade = None
+        # 批量分析的线程池，大小固定为推理批大小，随 cleanup() 关闭
+        self._batch_executor = ThreadPoolExecutor(max_workers=Config.INFER_BATCH, thread_name_prefix='deepface-batch')
+        atexit.register(self.cleanup)
         
         # GPU加速配置
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -456,12 +461,20 @@ class DeepFaceAnalyzer:
             }
     
     def analyze_batch(self, images: List[np.ndarray]) -> List[Dict[str, Any]]:
-        """批量分析多张图像"""
-        results = []
-        for image in images:
-            result = self.analyze(image)
-            results.append(result)
-        return results
+        """批量分析多张图像
+
+        DeepFace.analyze 只接受单张图像，这里用线程池并发提交，
+        底层TF/OpenCV推理会释放GIL，多帧推理可以重叠执行。
+        """
+        if len(images) <= 1 or self._batch_executor is None:
+            return [self.analyze(image) for image in images]
+        return list(self._batch_executor.map(self.analyze, images))
+    
+    def cleanup(self):
+        """关闭批量分析线程池"""
+        executor, self._batch_executor = self._batch_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
     
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
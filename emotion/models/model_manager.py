@@ -20,6 +20,8 @@ class ModelManager:
         
         # GPU管理器
         self._gpu_manager = None
+        # GPU管理器加载失败（如未安装torch）后不再重复尝试导入
+        self._gpu_manager_failed = False
         self._gpu_optimization_enabled = True
     
     def get_emotion2vec_analyzer(self):
@@ -128,12 +130,13 @@ class ModelManager:
     
     def get_gpu_manager(self):
         """获取GPU管理器"""
-        if self._gpu_manager is None:
+        if self._gpu_manager is None and not self._gpu_manager_failed:
             try:
-                from utils.gpu_manager import gpu_manager
-                self._gpu_manager = gpu_manager
+                from utils.gpu_manager import get_gpu_manager
+                self._gpu_manager = get_gpu_manager()
                 logger.info("✓ GPU管理器加载完成")
             except Exception as e:
+                self._gpu_manager_failed = True
                 logger.warning(f"GPU管理器加载失败: {e}")
         return self._gpu_manager
     
@@ -1,10 +1,19 @@
+import logging
+import sys
 import threading
 import time
+import itertools
+import functools
 import cv2
 import numpy as np
-from datetime import datetime
 import subprocess
 import os
+import select
+import queue
+from collections import deque
+import re
+import struct
+import mmap
 from shutil import which
 from typing import Optional, Callable, Dict, Any
 
@@ -12,21 +21,32 @@ from typing import Optional, Callable, Dict, Any
 _LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
 _LOG_LEVEL = _LEVELS.get(os.environ.get('AI_LOG_LEVEL', 'INFO').upper(), 10)
 
-def _log_debug(msg: str):
-    if _LOG_LEVEL <= 10:
-        print(msg)
+# 独立的 rtsp logger，输出格式与原先 print 一致，不受其他模块 basicConfig 影响
+logger = logging.getLogger('rtsp')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+logger.propagate = False
+logger.setLevel(_LOG_LEVEL)
 
-def _log_info(msg: str):
-    if _LOG_LEVEL <= 20:
-        print(msg)
+# 支持 %-style 惰性参数：_log_debug("stream=%s", name)，级别关闭时不做字符串格式化
+_log_debug = logger.debug
+_log_info = logger.info
+_log_warn = logger.warning
+_log_error = logger.error
 
-def _log_warn(msg: str):
-    if _LOG_LEVEL <= 30:
-        print(msg)
-
-def _log_error(msg: str):
-    if _LOG_LEVEL <= 40:
-        print(msg)
+# 级别被屏蔽的日志函数直接绑定为空操作；热路径上的 f-string 另用 _DEBUG 守卫，避免构造字符串
+_NOP = lambda *a, **kw: None
+_DEBUG = _LOG_LEVEL <= 10
+if _LOG_LEVEL > 10:
+    _log_debug = _NOP
+if _LOG_LEVEL > 20:
+    _log_info = _NOP
+if _LOG_LEVEL > 30:
+    _log_warn = _NOP
+if _LOG_LEVEL > 40:
+    _log_error = _NOP
 
 # 导入DataManager用于实时保存数据
 try:
@@ -42,63 +62,120 @@ try:
 except Exception:
     _cb = None
 
-def _maybe_send_checkpoint(session_id: Optional[str], model: str, payload: Dict[str, Any], min_interval: float = 1.0):
-    """使用DataManager实时保存数据到文件"""
+try:
+    from models.enhanced_ppg_detector import enhanced_ppg_detector
+except Exception as e:
+    enhanced_ppg_detector = None
+    _log_warn(f"[RTSP] PPG心率检测器导入失败: {e}, 将不进行心率检测")
+
+try:
+    from multiprocessing import shared_memory
+except Exception:
+    shared_memory = None
+
+def _save_video_checkpoint(session_id: str, payload: Dict[str, Any]) -> bool:
+    saved = data_manager.add_video_emotion(session_id, {
+        'dominant_emotion': payload.get('dominant_emotion', 'neutral'),
+        'emotions': payload.get('emotions', {}),
+        'confidence': payload.get('confidence', 0.0),
+        'face_detected': payload.get('face_detected', True)
+    })
+    if _DEBUG:
+        _log_debug(f"[RTSP] 保存视频情绪: {session_id}, 主导情绪: {payload.get('dominant_emotion')}")
+    return saved
+
+
+def _save_audio_checkpoint(session_id: str, payload: Dict[str, Any]) -> bool:
+    saved = data_manager.add_audio_emotion(session_id, {
+        'dominant_emotion': payload.get('dominant_emotion', 'neutral'),
+        'emotions': payload.get('emotions', {}),
+        'confidence': payload.get('confidence', 0.0)
+    })
+    if _DEBUG:
+        _log_debug(f"[RTSP] 保存音频情绪: {session_id}, 主导情绪: {payload.get('dominant_emotion')}")
+    return saved
+
+
+def _save_heart_checkpoint(session_id: str, payload: Dict[str, Any]) -> bool:
+    saved = data_manager.add_heart_rate_data(session_id, {
+        'heart_rate': payload.get('heart_rate', 0),
+        'confidence': payload.get('confidence', 0.0),
+        'signal_length': payload.get('signal_length', 0)
+    })
+    if _DEBUG:
+        _log_debug(f"[RTSP] 保存心率数据: {session_id}, 心率: {payload.get('heart_rate')}")
+    return saved
+
+
+def _checkpoint_handler(model: str) -> Optional[Callable[[str, Dict[str, Any]], bool]]:
+    """按模型名选择对应的DataManager写入函数（调用方可缓存结果，避免每次做字符串匹配）"""
+    m = model.lower()
+    if 'video' in m or 'face' in m:
+        return _save_video_checkpoint
+    if 'audio' in m or 'voice' in m:
+        return _save_audio_checkpoint
+    if 'heart' in m or 'ppg' in m:
+        return _save_heart_checkpoint
+    return None
+
+
+def _call_checkpoint(handler: Callable[[str, Dict[str, Any]], bool], session_id: str, payload: Dict[str, Any]) -> bool:
     try:
-        if not session_id or not data_manager:
-            return
-        
-        # 根据模型类型调用对应的DataManager方法
-        if 'video' in model.lower() or 'face' in model.lower():
-            data_manager.add_video_emotion(session_id, {
-                'dominant_emotion': payload.get('dominant_emotion', 'neutral'),
-                'emotions': payload.get('emotions', {}),
-                'confidence': payload.get('confidence', 0.0),
-                'face_detected': payload.get('face_detected', True)
-            })
-            _log_debug(f"[RTSP] 保存视频情绪: {session_id}, 主导情绪: {payload.get('dominant_emotion')}")
-            
-        elif 'audio' in model.lower() or 'voice' in model.lower():
-            data_manager.add_audio_emotion(session_id, {
-                'dominant_emotion': payload.get('dominant_emotion', 'neutral'),
-                'emotions': payload.get('emotions', {}),
-                'confidence': payload.get('confidence', 0.0)
-            })
-            _log_debug(f"[RTSP] 保存音频情绪: {session_id}, 主导情绪: {payload.get('dominant_emotion')}")
-            
-        elif 'heart' in model.lower() or 'ppg' in model.lower():
-            data_manager.add_heart_rate_data(session_id, {
-                'heart_rate': payload.get('heart_rate', 0),
-                'confidence': payload.get('confidence', 0.0),
-                'signal_length': payload.get('signal_length', 0)
-            })
-            _log_debug(f"[RTSP] 保存心率数据: {session_id}, 心率: {payload.get('heart_rate')}")
-            
+        return bool(handler(session_id, payload))
     except Exception as e:
         _log_warn(f"[RTSP] DataManager保存失败: {e}")
+        return False
+
 
 def ensure_session_created(session_id: str):
     """确保DataManager中存在该会话，如果不存在则创建"""
     if data_manager and session_id:
         try:
-            # 尝试加载会话，如果不存在则自动创建
-            existing = data_manager.load_session(session_id)
-            if not existing:
+            # 会话不存在则自动创建（只检查存在性，不复制会话数据）
+            if not data_manager.has_session(session_id):
                 _log_info(f"[RTSP] 创建新的DataManager会话: {session_id}")
                 data_manager.create_session(session_id)
             else:
-                _log_debug(f"[RTSP] 会话已存在: {session_id}")
+                if _DEBUG:
+                    _log_debug(f"[RTSP] 会话已存在: {session_id}")
         except Exception as e:
             _log_warn(f"[RTSP] 检查/创建会话失败: {e}")
 
+# 视频情绪推理批大小上限（跨流汇集，摊薄单次调用开销），同时也是每路流的在途帧数上限
+_INFER_BATCH = max(1, int(os.environ.get('AI_INFER_BATCH', '4') or 4))
+# 自适应发送间隔的下限（秒）：实际间隔跟随分析耗时的EMA，不再固定0.5秒
+_ANALYZE_MIN_INTERVAL = float(os.environ.get('AI_ANALYZE_MIN_INTERVAL', '0.1') or 0.1)
+# 超过该时长（秒）未读到新帧则判定断流并重连
+_STALL_RECONNECT_SEC = 1.5
+# 等待FFmpeg视频管道出下一帧的单次最长时间（秒），超时后回到主循环做断流检查和停止检查
+_FF_READ_TIMEOUT_SEC = 0.5
+# FFmpeg 启动后连接RTSP、出第一帧的宽限时间（秒），期间不按断流处理
+_FF_START_GRACE_SEC = 10.0
+# 结果未变化时的推送保活间隔（秒）
+_EMIT_KEEPALIVE_SEC = 10.0
+# 教师端转发：默认把同一周期的视频情绪与心率合并为一个 student_combined_result 事件；
+# AI_LEGACY_STUDENT_EVENTS=1 时额外发送旧的 student_video_emotion_result / student_heart_rate_result
+_LEGACY_STUDENT_EVENTS = os.environ.get('AI_LEGACY_STUDENT_EVENTS', '0').lower() in ('1', 'true', 'yes')
+# 会话映射连续为空的次数上限（每2秒查询一次），超过后停止查询
+_MAPPER_MAX_MISSES = 50
+# 停止常规查询后，仍按该间隔（秒）低频重新查询一次，会话晚于推流创建或流被新会话复用时也能重新映射
+_MAPPER_IDLE_RETRY_SEC = 30.0
+# 画面变化阈值（32x32缩略图逐像素平均绝对差）与最长跳过时间（秒）：低于阈值的帧复用上次DeepFace结果
+_SCENE_DIFF_THRESHOLD = 2.0
+_SCENE_MAX_SKIP_SEC = 1.5
+# 每次读帧后丢弃积压旧帧的最长耗时（秒），只分析最新一帧
+_DRAIN_DEADLINE_SEC = 0.005
+
 _socketio = None
 _app = None
 _session_mapper: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None
 
 # 轻量级最新状态缓存（用于HTTP轮询/SSE下行）
+# 写入方每次发布新的 dict 对象（发布后不再修改），读取方直接取当前对象，无需加锁；
+# 视频与心率结果来自不同线程，写入方的 读取-合并-发布 由 _state_lock 串行化，避免互相覆盖对方的更新
 _latest_state: Dict[str, Dict[str, Any]] = {}
 _state_lock = threading.Lock()
-_state_version = 0
+_next_version = itertools.count(1).__next__
 
 
 def set_socketio(socketio, app=None):
@@ -115,29 +192,25 @@ def set_session_mapper(mapper: Callable[[str], Optional[Dict[str, Any]]]):
     _session_mapper = mapper
 
 
-def _bump_version() -> int:
-    global _state_version
-    _state_version += 1
-    return _state_version
-
-
 def _update_state(stream_name: str, key: str, payload: Dict[str, Any]):
     """更新某个流的最新状态。
     key: 'video' | 'heart'
     payload: 可序列化的结果数据
     """
-    ts = datetime.now().isoformat()
+    ts = time.time()
     with _state_lock:
-        st = _latest_state.get(stream_name) or {
-            'stream_name': stream_name,
-            'version': 0,
-            'updated_at': ts,
-            'video': None,
-            'heart': None,
-        }
-        st[key] = payload
-        st['updated_at'] = ts
-        st['version'] = _bump_version()
+        prev = _latest_state.get(stream_name)
+        if prev is not None:
+            st = {**prev, key: payload, 'updated_at': ts, 'version': _next_version()}
+        else:
+            st = {
+                'stream_name': stream_name,
+                'version': _next_version(),
+                'updated_at': ts,
+                'video': None,
+                'heart': None,
+                key: payload,
+            }
         _latest_state[stream_name] = st
 
 
@@ -145,65 +218,437 @@ def get_latest_state(stream_name: Optional[str]) -> Optional[Dict[str, Any]]:
     """获取某条流的最新状态（浅拷贝）。"""
     if not stream_name:
         return None
-    with _state_lock:
-        st = _latest_state.get(stream_name)
-        if not st:
-            return None
-        # 返回浅拷贝，避免并发读写问题
-        out = dict(st)
-        if out.get('video') is not None:
-            out['video'] = dict(out['video'])
-        if out.get('heart') is not None:
-            out['heart'] = dict(out['heart'])
-        return out
+    st = _latest_state.get(stream_name)
+    return dict(st) if st else None
+
+
+def _push_app_context():
+    """为后台线程推入一次Flask应用上下文（整个线程生命周期内复用），返回需在退出时pop的上下文"""
+    if _app is None:
+        return None
+    try:
+        ctx = _app.app_context()
+        ctx.push()
+        return ctx
+    except Exception as e:
+        _log_warn(f"[RTSP] 推入应用上下文失败: {e}")
+        return None
+
+
+def _pop_app_context(ctx):
+    if ctx is not None:
+        try:
+            ctx.pop()
+        except Exception:
+            pass
 
 
 def _safe_emit(event, data, **kwargs):
-    """在后台线程中安全地发送Socket.IO事件"""
+    """在后台线程中安全地发送Socket.IO事件
+
+    socketio.emit 本身线程安全；应用上下文由消费线程在启动时推入一次，这里不再逐次进入。
+    """
     if _socketio is None:
         _log_warn(f"[RTSP] ❌ Socket.IO未初始化，无法发送事件: {event}")
         return False
     
     try:
-        if _app is not None:
-            # 使用Flask应用上下文
-            with _app.app_context():
-                _socketio.emit(event, data, **kwargs)
-                return True
-        else:
-            # 如果没有app实例，直接尝试发送
-            _socketio.emit(event, data, **kwargs)
-            return True
+        _socketio.emit(event, data, **kwargs)
+        return True
     except Exception as e:
         _log_warn(f"[RTSP] ❌ 发送事件失败 {event}: {e}")
         return False
 
 
+def _emit_many(event, data, targets) -> int:
+    """按 (namespace, room) 目标列表发送同一事件，返回成功发送的次数"""
+    sent = 0
+    for ns, room in targets:
+        kwargs = {}
+        if ns:
+            kwargs['namespace'] = ns
+        if room:
+            kwargs['room'] = room
+        if _safe_emit(event, data, **kwargs):
+            sent += 1
+    return sent
+
+
+def _detect_gstreamer() -> bool:
+    try:
+        for line in cv2.getBuildInformation().splitlines():
+            if 'GStreamer' in line:
+                return 'YES' in line
+    except Exception:
+        pass
+    return False
+
+
+# OpenCV 是否带 GStreamer 后端（pip 版 opencv-python 通常不带）；AI_GST_NVDEC=1 时使用 NVIDIA 硬件解码元件
+_HAS_GSTREAMER = _detect_gstreamer()
+_GST_NVDEC = os.environ.get('AI_GST_NVDEC', '0') == '1'
+
+
+# FFmpeg 硬件解码方式：AI_FFMPEG_HWACCEL=auto（默认，按 cuda > vaapi > qsv 探测）/none/具体名称
+_HWACCEL_PREFERENCE = ('cuda', 'vaapi', 'qsv')
+_hwaccel_cache: Dict[str, Optional[str]] = {}
+_hwaccel_lock = threading.Lock()
+
+
+def _probe_hwaccel(ffbin: str) -> Optional[str]:
+    """探测一次 ffmpeg -hwaccels 并缓存结果"""
+    with _hwaccel_lock:
+        if ffbin in _hwaccel_cache:
+            return _hwaccel_cache[ffbin]
+        choice = None
+        wanted = os.environ.get('AI_FFMPEG_HWACCEL', 'auto').strip().lower()
+        if wanted not in ('none', 'off', '0', ''):
+            try:
+                out = subprocess.run([ffbin, '-hide_banner', '-hwaccels'], capture_output=True, text=True, timeout=5).stdout
+                methods = {ln.strip() for ln in out.splitlines()[1:] if ln.strip()}
+                if wanted == 'auto':
+                    choice = next((m for m in _HWACCEL_PREFERENCE if m in methods), None)
+                elif wanted in methods:
+                    choice = wanted
+            except Exception as e:
+                _log_warn(f"[RTSP/FFmpeg] 探测硬件解码失败: {e}")
+        _hwaccel_cache[ffbin] = choice
+        _log_info(f"[RTSP/FFmpeg] 硬件解码: {choice or '未启用'}")
+        return choice
+
+
+# 全量广播目标：默认命名空间 + /monitor
+_BROADCAST_TARGETS = ((None, None), ('/monitor', None))
+# 备用事件名只发送到前端实际订阅的命名空间
+_MONITOR_ONLY_TARGETS = (('/monitor', None),)
+_DEFAULT_ONLY_TARGETS = ((None, None),)
+
+# 共享内存帧头：seq(u64，奇数=写入中/偶数=稳定) + 时间戳(f64) + 高/宽(u32)，其后紧跟 RGB 像素
+_SHM_HEADER = struct.Struct('<QdII')
+
+
+# 每个消费者实例一个序号：同名流重启时新旧线程可能短暂并存，各自持有独立的共享内存块
+_shm_seq = itertools.count(1).__next__
+
+
+def _shm_name(stream_name: str) -> str:
+    return f"mtp_rtsp_{os.getpid()}_{_shm_seq()}_{re.sub(r'[^A-Za-z0-9_]', '_', stream_name)}"
+
+
+class _SharedFrame:
+    """单写多读的最新帧共享内存（seqlock），同机其他模块/进程按名称读取，无需重复解码"""
+
+    def __init__(self, name: str, shape):
+        h, w = shape[:2]
+        self.shape = (h, w, 3)
+        size = _SHM_HEADER.size + h * w * 3
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上次异常退出遗留的同名块
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.frame = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=_SHM_HEADER.size)
+        self.seq = 0
+        _SHM_HEADER.pack_into(self.shm.buf, 0, 0, 0.0, h, w)
+
+    def publish(self, frame: np.ndarray, ts: float):
+        h, w = self.shape[:2]
+        self.seq += 1
+        _SHM_HEADER.pack_into(self.shm.buf, 0, self.seq, ts, h, w)
+        np.copyto(self.frame, frame)
+        self.seq += 1
+        _SHM_HEADER.pack_into(self.shm.buf, 0, self.seq, ts, h, w)
+
+    def close(self):
+        # 先释放对 shm.buf 的 ndarray 引用，否则 close 会因导出缓冲仍存在而失败
+        self.frame = None
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except Exception:
+            pass
+
+
+def read_shared_frame(name: str, out: Optional[np.ndarray] = None, retries: int = 3):
+    """按名称读取共享内存中的最新帧，返回 (seq, timestamp, frame)；无可用帧返回 None
+
+    写入方更新期间 seq 为奇数，读取前后 seq 不一致则重试，保证拿到完整的一帧。
+    """
+    if shared_memory is None:
+        return None
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except Exception:
+        return None
+    try:
+        for _ in range(retries):
+            seq, ts, h, w = _SHM_HEADER.unpack_from(shm.buf, 0)
+            if seq == 0 or seq & 1:
+                time.sleep(0.001)
+                continue
+            view = np.ndarray((h, w, 3), dtype=np.uint8, buffer=shm.buf, offset=_SHM_HEADER.size)
+            if out is None or out.shape != view.shape:
+                out = np.empty(view.shape, dtype=np.uint8)
+            np.copyto(out, view)
+            del view
+            if _SHM_HEADER.unpack_from(shm.buf, 0)[0] == seq:
+                return seq, ts, out
+        return None
+    finally:
+        shm.close()
+
+
+class _FrameBuffers:
+    """读帧线程独占的预分配帧缓冲：缩放输出（BGR）与最终交给分析的 RGB 帧
+
+    按尺寸惰性创建、尺寸变化时重建；FFmpeg 与 OpenCV 兜底路径不会同时出帧，共用同一块 RGB 缓冲。
+    """
+    __slots__ = ('resized_bgr', 'rgb')
+
+    def __init__(self):
+        self.resized_bgr: Optional[np.ndarray] = None
+        self.rgb: Optional[np.ndarray] = None
+
+    def ensure(self, name: str, shape) -> np.ndarray:
+        buf = getattr(self, name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint8)
+            # cv2 的 dst= 只有在连续内存上才会原地写入，否则会另行分配
+            assert buf.flags['C_CONTIGUOUS']
+            setattr(self, name, buf)
+        return buf
+
+
+class _BatchAnalyzer:
+    """跨流批量推理：汇集各路消费者提交的帧，凑满 batch_size 帧或等待 window 秒后一次 analyze_batch
+
+    多路流共用同一个 DeepFace 分析器，由单个线程统一提交，避免各路在分析器上互相串行等待。
+    结果通过提交时给出的回调 callback(frame, result, cost_ms) 在批处理线程中返回。
+    """
+
+    def __init__(self, model_manager, batch_size: int = _INFER_BATCH, window: float = 0.03):
+        self.model_manager = model_manager
+        self.batch_size = batch_size
+        self.window = window
+        self._q: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, frame: np.ndarray, callback: Callable) -> None:
+        """非阻塞提交一帧"""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='rtsp-batch-analyzer', daemon=True)
+                    self._thread.start()
+        self._q.put_nowait((frame, callback))
+
+    def _run(self):
+        while True:
+            items = [self._q.get()]
+            deadline = time.monotonic() + self.window
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rs = None
+            cost_ms = 0.0
+            try:
+                analyzer = self.model_manager.get_deepface_analyzer()
+                if analyzer is not None:
+                    if hasattr(analyzer, 'is_initialized') and not analyzer.is_initialized:
+                        if hasattr(analyzer, 'initialize'):
+                            analyzer.initialize()
+                    t0 = time.time()
+                    rs = analyzer.analyze_batch([frame for frame, _ in items])
+                    cost_ms = (time.time() - t0) * 1000.0
+            except Exception as e:
+                _log_warn(f"[RTSP] 批量推理失败: {e}")
+            # 失败时也回调（result=None），让提交方释放帧缓冲
+            for i, (frame, callback) in enumerate(items):
+                try:
+                    callback(frame, rs[i] if rs and i < len(rs) else None, cost_ms)
+                except Exception:
+                    pass
+
+
 class _ConsumerThread(threading.Thread):
-    def __init__(self, stream_name: str, rtsp_url: str, model_manager):
+    def __init__(self, stream_name: str, rtsp_url: str, model_manager, batcher: Optional[_BatchAnalyzer] = None):
         super().__init__(daemon=True)
         self.stream_name = stream_name
         self.rtsp_url = rtsp_url
+        self._room_targets = (('/monitor', f"stream:{stream_name}"),)
+        # stream_name -> 学生会话映射缓存（映射只在学生加入/离开时变化，按2秒刷新）
+        self._mapped_info: Dict[str, Any] = {}
+        self._mapped_info_ts = 0.0
+        # 连续多次映射为空（仅监控、无学生对应的流）后改为每 _MAPPER_IDLE_RETRY_SEC 秒查询一次，invalidate_mapping() 立即恢复
+        self._mapper_state = 'unknown'
+        self._mapper_miss_count = 0
+        # 已确认会话的检查点写入函数 (会话ID, 模型) -> partial，避免每个分析周期读盘检查与按模型名分派
+        self._checkpoint_fns: Dict[Any, Callable[[Dict[str, Any]], bool]] = {}
         self.model_manager = model_manager
         self._stop = threading.Event()
-        self.connected = False
+        # 低频变化的状态（连接/音频线程/共享内存）在变化时整体替换为新字典，status() 直接读取无需加锁
+        self._status_snapshot: Dict[str, Any] = {
+            'connected': False,
+            'rtsp_url': rtsp_url,
+            'audio_started': False,
+            'shm_name': None,
+        }
         self.last_frame_ts = 0.0
         self._ff_proc = None
+        self._ff_video_out = None
+        self._ff_audio_out = None
+        self._ff_with_audio = True
+        self._ff_frames = 0
+        self._ff_start_ts = 0.0
         self._ff_w = 640
         self._ff_h = 360
+        # 常驻的帧读取缓冲及其 NV12 视图，避免每帧分配 bytes；
+        # Linux 下缓冲为 memfd 映射，帧数据由 os.splice 在内核内从管道移入，不经用户态拷贝
+        self._ff_buf = None
+        self._ff_memfd: Optional[int] = None
+        self._ff_view: Optional[memoryview] = None
+        self._ff_nv12: Optional[np.ndarray] = None
         # 音频相关
-        self._ff_proc_audio = None
         self._audio_thread = None
-        self._audio_buf = bytearray()
+        self._audio_reader_thread = None
         self._audio_sr = 16000
         self._audio_channels = 1
         self._audio_bytes_per_sample = 2  # s16le
         self._audio_chunk_sec = 2.0  # 每段2秒
+        self._audio_chunk_bytes = int(self._audio_sr * self._audio_chunk_sec) * self._audio_bytes_per_sample
+        # 固定容量环形缓冲（4段），_audio_w/_audio_r 为累计写/读字节数；读取线程写入、分析线程取出，由 _audio_cond 保护
+        self._audio_ring = bytearray(self._audio_chunk_bytes * 4)
+        self._audio_w = 0
+        self._audio_r = 0
+        self._audio_cond = threading.Condition()
         self._audio_bytes_read = 0
         self._audio_chunks = 0
         self._audio_last_ts = 0.0
+        # 跨流批量推理器（由管理器共享）；_pending 为已提交但尚未返回结果的帧（id -> 帧缓冲）
+        self._batcher = batcher or _BatchAnalyzer(model_manager)
+        self._pending: Dict[int, np.ndarray] = {}
+        # 场景变化检测：32x32 缩略图两块交替使用，画面几乎不变时跳过 DeepFace，复用上次结果
+        self._thumbs = [np.empty((32, 32, 3), dtype=np.uint8), np.empty((32, 32, 3), dtype=np.uint8)]
+        self._thumb_valid = False
+        self._last_submit_ts = 0.0
+        self._last_result: Optional[Dict[str, Any]] = None
+        self._analyze_ms_ema = 0.0
+        # 各类结果最近一次发送的签名与时间（video/audio/heart），用于合并重复推送
+        self._last_sig: Dict[str, Any] = {}
+        self._last_sig_ts: Dict[str, float] = {}
+        # 读帧线程的预分配缩放/颜色转换输出缓冲
+        self._fb = _FrameBuffers()
+        # 读帧与分析解耦：单槽队列只保留最新帧，分析线程消费；推送限频/诊断时间在分析线程维护
+        self._analyze_q: queue.Queue = queue.Queue(maxsize=1)
+        # 移交帧副本的回收池：分析线程用完（不再被推理批引用）后归还，读帧线程复用，避免每帧分配
+        self._frame_pool: deque = deque()
+        self._analyze_thread = None
+        self._last_emit = 0.0
+        self._last_diag = 0.0
+        # 解码后的最新帧发布到共享内存（按首帧尺寸惰性创建），名称通过 status() 暴露
+        self.shm_name = _shm_name(stream_name) if shared_memory is not None else None
+        self._shm: Optional[_SharedFrame] = None
+
+    def _publish_status(self, **changes):
+        snap = self._status_snapshot
+        if any(snap.get(k) != v for k, v in changes.items()):
+            self._status_snapshot = {**snap, **changes}
+
+    @property
+    def connected(self) -> bool:
+        return self._status_snapshot['connected']
+
+    @connected.setter
+    def connected(self, value: bool):
+        self._publish_status(connected=bool(value))
+
+    def _should_emit(self, kind: str, sig, now: float) -> bool:
+        """结果签名未变化且距上次发送不足保活间隔时跳过推送"""
+        if sig == self._last_sig.get(kind) and (now - self._last_sig_ts.get(kind, 0.0)) < _EMIT_KEEPALIVE_SEC:
+            return False
+        self._last_sig[kind] = sig
+        self._last_sig_ts[kind] = now
+        return True
+
+    def _checkpoint(self, sid: Optional[str], model: str, payload: Dict[str, Any]):
+        """写入检查点；保底写入：未映射到学生会话ID时以 stream_name 作为会话键，确保缓冲有数据
+
+        会话确认后按 (会话, 模型) 缓存绑定好会话ID的写入函数，后续周期直接调用。
+        """
+        if not data_manager:
+            return
+        target_sid = sid or self.stream_name
+        key = (target_sid, model)
+        fn = self._checkpoint_fns.get(key)
+        if fn is None:
+            handler = _checkpoint_handler(model)
+            if handler is None:
+                return
+            ensure_session_created(target_sid)
+            fn = self._checkpoint_fns[key] = functools.partial(_call_checkpoint, handler, target_sid)
+        if not fn(payload):
+            # 会话可能已被结束/删除，下个周期重新确认
+            self._checkpoint_fns.pop(key, None)
+
+    def _get_mapping(self, now: float) -> Dict[str, Any]:
+        """返回缓存的会话映射，过期后重新调用 _session_mapper（长期未映射的流降低查询频率）"""
+        interval = _MAPPER_IDLE_RETRY_SEC if self._mapper_state == 'none' else 2.0
+        if _session_mapper is not None and (now - self._mapped_info_ts) > interval:
+            try:
+                info = _session_mapper(self.stream_name)
+                if isinstance(info, dict) and info:
+                    self._mapped_info = info
+                    self._mapper_state = 'mapped'
+                    self._mapper_miss_count = 0
+                else:
+                    self._mapped_info = {}
+                    self._mapper_miss_count += 1
+                    if self._mapper_miss_count >= _MAPPER_MAX_MISSES:
+                        if self._mapper_state != 'none':
+                            _log_info(f"[RTSP] 流未映射到学生会话，降低映射查询频率: {self.stream_name}")
+                        self._mapper_state = 'none'
+            except Exception:
+                pass
+            self._mapped_info_ts = now
+        return self._mapped_info
+
+    def invalidate_mapping(self):
+        """映射关系变化（学生加入/绑定/解绑）时调用，下个周期立即重新查询"""
+        self._mapper_state = 'unknown'
+        self._mapper_miss_count = 0
+        self._mapped_info_ts = 0.0
+
+    def _build_gst_pipeline(self, url: str) -> str:
+        """低延迟 GStreamer 管道：rtspsrc 不缓冲，appsink 只保留最新一帧"""
+        if _GST_NVDEC:
+            decode = 'nvv4l2decoder enable-max-performance=1 disable-dpb=1 ! nvvidconv'
+        else:
+            decode = 'avdec_h264'
+        return (
+            f'rtspsrc location={url} latency=0 drop-on-latency=true protocols=tcp ! '
+            f'rtph264depay ! h264parse ! {decode} ! videoconvert ! video/x-raw,format=BGR ! '
+            'appsink sync=false max-buffers=1 drop=true'
+        )
 
     def _open_capture(self):
+        # 优先 GStreamer 管道（避免 VideoCapture 默认后端累积数秒缓冲），不可用时回退默认后端
+        if _HAS_GSTREAMER and not self._stop.is_set():
+            cap = cv2.VideoCapture(self._build_gst_pipeline(self.rtsp_url), cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap
+            try:
+                cap.release()
+            except Exception:
+                pass
         # 尝试原始URL 与 TCP优先URL
         urls = [self.rtsp_url]
         if 'rtsp_transport=' not in self.rtsp_url:
@@ -216,7 +661,7 @@ class _ConsumerThread(threading.Thread):
                 cap = cv2.VideoCapture(u)
                 if cap.isOpened():
                     if u != self.rtsp_url:
-                        print(f"[RTSP] 使用TCP连接成功: {u}")
+                        _log_info("[RTSP] 使用TCP连接成功: %s", u)
                     return cap
                 try:
                     cap.release()
@@ -225,6 +670,10 @@ class _ConsumerThread(threading.Thread):
         return None
 
     def _start_ffmpeg(self):
+        """启动单个FFmpeg进程，同时解复用视频与音频到两条管道，只占用一个RTSP会话
+
+        视频以 NV12（1.5字节/像素）输出，管道带宽是 bgr24 的一半，颜色转换由 OpenCV SIMD 完成。
+        """
         if self._ff_proc is not None:
             return True
         try:
@@ -234,183 +683,588 @@ class _ConsumerThread(threading.Thread):
                 url = f"{url}{sep}rtsp_transport=tcp"
             ffbin = os.environ.get('FFMPEG_BIN') or which('ffmpeg') or '/usr/bin/ffmpeg'
             if not os.path.exists(ffbin):
-                _log_warn(f"[RTSP/FFmpeg] 未找到 ffmpeg 可执行文件（FFMPEG_BIN={os.environ.get('FFMPEG_BIN','')}). 将不启用FFmpeg兜底解码")
+                _log_warn(f"[RTSP/FFmpeg] 未找到 ffmpeg 可执行文件（FFMPEG_BIN={os.environ.get('FFMPEG_BIN','')}). 将不启用FFmpeg解码，音频分析禁用")
                 self._ff_proc = None
                 return False
-            cmd = [
-                ffbin, '-nostdin', '-hide_banner', '-loglevel', 'warning',
+            rv, wv = os.pipe()
+            pass_fds = [wv]
+            cmd = [ffbin, '-nostdin', '-hide_banner', '-loglevel', 'warning']
+            hwaccel = _probe_hwaccel(ffbin)
+            if hwaccel:
+                # 解码在GPU固定功能单元完成，帧自动下载到内存后再缩放
+                cmd += ['-hwaccel', hwaccel]
+            cmd += [
                 '-rtsp_transport', 'tcp', '-i', url,
-                '-an', '-vf', f'scale={self._ff_w}:{self._ff_h}',
-                '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1'
+                '-map', '0:v', '-vf', f'scale={self._ff_w}:{self._ff_h}',
+                '-pix_fmt', 'nv12', '-f', 'rawvideo', f'pipe:{wv}',
             ]
-            self._ff_proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=self._ff_w*self._ff_h*3)
-            _log_info(f"[RTSP/FFmpeg] 已启动FFmpeg解码管道")
+            ra = wa = None
+            if self._ff_with_audio:
+                # 输出16kHz单声道s16le原始PCM到音频管道
+                ra, wa = os.pipe()
+                pass_fds.append(wa)
+                cmd += [
+                    '-map', '0:a', '-ac', str(self._audio_channels), '-ar', str(self._audio_sr),
+                    '-f', 's16le', f'pipe:{wa}',
+                ]
+            try:
+                self._ff_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, pass_fds=pass_fds)
+            finally:
+                # 写端已交给子进程，父进程关闭自己的副本，子进程退出时读端才能收到EOF
+                for fd in pass_fds:
+                    os.close(fd)
+            # 视频端不做用户态缓冲：splice/readinto 直接从管道取整帧
+            self._ff_video_out = os.fdopen(rv, 'rb', buffering=0)
+            if self._ff_buf is None:
+                self._alloc_frame_buf()
+            # 音频端不做用户态缓冲，由 _audio_worker 直接 os.read
+            self._ff_audio_out = os.fdopen(ra, 'rb', buffering=0) if ra is not None else None
+            self._ff_frames = 0
+            self._ff_start_ts = time.time()
+            _log_info(f"[RTSP/FFmpeg] 已启动FFmpeg解码管道（音频: {'开启' if ra is not None else '关闭'}）")
             return True
         except Exception as e:
             _log_warn(f"[RTSP/FFmpeg] 启动失败: {e}")
-            self._ff_proc = None
+            self._stop_ffmpeg()
             return False
 
-    def _start_ffmpeg_audio(self):
-        if self._ff_proc_audio is not None:
-            return True
+    def _alloc_frame_buf(self):
+        size = self._ff_w * self._ff_h * 3 // 2
+        if hasattr(os, 'splice') and hasattr(os, 'memfd_create'):
+            fd = None
+            try:
+                fd = os.memfd_create(f"rtsp_{self.stream_name}")
+                os.ftruncate(fd, size)
+                self._ff_buf = mmap.mmap(fd, size)
+                self._ff_memfd = fd
+            except (OSError, ValueError) as e:
+                _log_debug("[RTSP/FFmpeg] memfd 不可用，改用 readinto: %s", e)
+                if fd is not None:
+                    os.close(fd)
+        if self._ff_buf is None:
+            self._ff_buf = bytearray(size)
+        self._ff_view = memoryview(self._ff_buf)
+        self._ff_nv12 = np.frombuffer(self._ff_buf, np.uint8).reshape((self._ff_h * 3 // 2, self._ff_w))
+
+    def _release_frame_buf(self):
+        # 先释放所有导出视图，mmap 才能关闭
+        self._ff_nv12 = None
+        if self._ff_view is not None:
+            self._ff_view.release()
+            self._ff_view = None
+        if isinstance(self._ff_buf, mmap.mmap):
+            self._ff_buf.close()
+        self._ff_buf = None
+        if self._ff_memfd is not None:
+            os.close(self._ff_memfd)
+            self._ff_memfd = None
+
+    def _stop_ffmpeg(self):
+        if self._ff_proc is not None:
+            try:
+                self._ff_proc.kill()
+            except Exception:
+                pass
+            self._ff_proc = None
+        for attr in ('_ff_video_out', '_ff_audio_out'):
+            f = getattr(self, attr)
+            setattr(self, attr, None)
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+
+    def _audio_reader(self):
+        """专职读取音频管道写入环形缓冲（满时丢弃最旧数据）
+
+        与推理线程分开：Emotion2Vec 初始化或推理较慢时管道仍被及时读空，
+        FFmpeg 不会因音频管道写满而阻塞（同一进程的视频输出也随之停住）。
+        """
         try:
-            url = self.rtsp_url
-            if 'rtsp_transport=' not in url:
-                sep = '&' if '?' in url else '?'
-                url = f"{url}{sep}rtsp_transport=tcp"
-            ffbin = os.environ.get('FFMPEG_BIN') or which('ffmpeg') or '/usr/bin/ffmpeg'
-            if not os.path.exists(ffbin):
-                _log_warn(f"[RTSP/FFmpeg-Audio] 未找到 ffmpeg 可执行文件，音频分析禁用")
-                self._ff_proc_audio = None
-                return False
-            # 输出16kHz单声道s16le原始PCM到stdout
-            cmd = [
-                ffbin, '-nostdin', '-hide_banner', '-loglevel', 'warning',
-                '-rtsp_transport', 'tcp', '-i', url,
-                '-vn', '-ac', str(self._audio_channels), '-ar', str(self._audio_sr),
-                '-f', 's16le', 'pipe:1'
-            ]
-            self._ff_proc_audio = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            _log_info(f"[RTSP/FFmpeg-Audio] 已启动FFmpeg音频解码管道")
-            return True
+            while not self._stop.is_set():
+                # 音频管道由 run() 中的 FFmpeg 进程提供，重启期间可能暂时为空
+                audio_out = self._ff_audio_out
+                if audio_out is None:
+                    self._stop.wait(0.5)
+                    continue
+                try:
+                    # 阻塞等待数据就绪（最多0.5秒，以便响应停止信号），一次最多取64KB
+                    fd = audio_out.fileno()
+                    if not select.select([fd], [], [], 0.5)[0]:
+                        continue
+                    data = os.read(fd, 65536)
+                except (ValueError, OSError):
+                    data = b''
+                if not data:
+                    # EOF：FFmpeg已退出，等待 run() 重启管道
+                    self._stop.wait(0.5)
+                    continue
+                with self._audio_cond:
+                    self._audio_ring_write(data)
+                    self._audio_bytes_read += len(data)
+                    self._audio_cond.notify()
         except Exception as e:
-            _log_warn(f"[RTSP/FFmpeg-Audio] 启动失败: {e}")
-            self._ff_proc_audio = None
-            return False
+            _log_warn(f"[RTSP/AUDIO] 音频读取线程异常退出: {e}")
 
     def _audio_worker(self):
-        """读取音频PCM并分段分析（Emotion2Vec）"""
+        """从环形缓冲按段取出PCM并分析（Emotion2Vec）；管道读取在 _audio_reader 线程"""
+        app_ctx = _push_app_context()
         try:
-            if not self._start_ffmpeg_audio():
-                return
-            chunk_bytes = int(self._audio_sr * self._audio_chunk_sec) * self._audio_bytes_per_sample
+            chunk_bytes = self._audio_chunk_bytes
             last_emit = 0.0
             while not self._stop.is_set():
-                if self._ff_proc_audio is None or self._ff_proc_audio.stdout is None:
-                    time.sleep(0.05)
-                    continue
-                data = self._ff_proc_audio.stdout.read(4096)
-                if not data:
-                    time.sleep(0.01)
-                    continue
-                self._audio_buf.extend(data)
-                self._audio_bytes_read += len(data)
-                while len(self._audio_buf) >= chunk_bytes:
-                    chunk = self._audio_buf[:chunk_bytes]
-                    del self._audio_buf[:chunk_bytes]
+                with self._audio_cond:
+                    if (self._audio_w - self._audio_r) < chunk_bytes:
+                        self._audio_cond.wait(0.5)
+                        continue
+                    # s16le -> float32 numpy 波形，单声道；在锁内复制出来，读取线程随后可覆盖环形缓冲
+                    audio_np = self._audio_ring_take(chunk_bytes).astype(np.float32) / 32768.0
+                try:
+                    # 分析
+                    emo2v = self.model_manager.get_emotion2vec_analyzer()
+                    if not emo2v.is_initialized:
+                        emo2v.initialize()
+                    res = emo2v.analyze_array(audio_np, sample_rate=self._audio_sr)
+                    now = time.time()
+                    res['timestamp'] = now
+                    # 精简负载，避免过大导致传输异常
+                    res_emit = {
+                        'emotions': res.get('emotions') or {},
+                        'dominant_emotion': res.get('dominant_emotion'),
+                        'confidence': res.get('confidence'),
+                        'model': res.get('model'),
+                        'analysis_quality': res.get('analysis_quality') or 'high',
+                        'timestamp': res.get('timestamp')
+                    }
+                    self._audio_chunks += 1
+                    self._audio_last_ts = now
+                    # 状态缓存
                     try:
-                        # s16le -> float32/64 numpy 波形，单声道
-                        import numpy as _np
-                        audio_np = _np.frombuffer(chunk, dtype=_np.int16).astype(_np.float32) / 32768.0
-                        # 分析
-                        emo2v = self.model_manager.get_emotion2vec_analyzer()
-                        if not emo2v.is_initialized:
-                            emo2v.initialize()
-                        res = emo2v.analyze_array(audio_np, sample_rate=self._audio_sr)
-                        res['timestamp'] = datetime.now().isoformat()
-                        # 精简负载，避免过大导致传输异常
-                        res_emit = {
-                            'emotions': res.get('emotions') or {},
-                            'dominant_emotion': res.get('dominant_emotion'),
-                            'confidence': res.get('confidence'),
-                            'model': res.get('model'),
-                            'analysis_quality': res.get('analysis_quality') or 'high',
-                            'timestamp': res.get('timestamp')
-                        }
-                        self._audio_chunks += 1
-                        self._audio_last_ts = time.time()
-                        # 状态缓存
-                        try:
-                            _update_state(self.stream_name, 'audio', res_emit)
-                        except Exception:
-                            pass
-                        # 组装payload
-                        payload = {
-                            'session_id': self.stream_name,
+                        _update_state(self.stream_name, 'audio', res_emit)
+                    except Exception:
+                        pass
+                    # 组装payload
+                    payload = {
+                        'session_id': self.stream_name,
+                        'stream_name': self.stream_name,
+                        'result': res_emit
+                    }
+                    send_audio = self._should_emit('audio', (
+                        res_emit.get('dominant_emotion'), round(res_emit.get('confidence') or 0.0, 2)
+                    ), now)
+                    if send_audio:
+                        if _emit_many('audio_emotion_result', payload, _BROADCAST_TARGETS):
+                            if _DEBUG and (now - last_emit) > 1.0:
+                                _log_debug(f"[RTSP/AUDIO] 广播 audio_emotion_result: stream={self.stream_name}, dom={res.get('dominant_emotion')}")
+                        # 备用事件名（仅默认命名空间有订阅）
+                        _emit_many('rtsp_audio_analysis', payload, _DEFAULT_ONLY_TARGETS)
+                        # 推送到房间 stream:<name> 的学生音频事件
+                        _emit_many('student.audio', payload, self._room_targets)
+                    # 学生定向/教师事件
+                    info = self._get_mapping(now)
+                    sid = info.get('session_id')
+                    student_id = info.get('student_id')
+                    sid_default = info.get('sid_default')
+                    sid_monitor = info.get('sid_monitor')
+                    self._checkpoint(sid, 'audio_emotion', {
+                        'dominant_emotion': res_emit.get('dominant_emotion'),
+                        'confidence': res_emit.get('confidence'),
+                        'emotions': res_emit.get('emotions'),
+                    })
+                    if sid and send_audio:
+                        _safe_emit('student_audio_emotion_result', {
+                            'session_id': sid,
+                            'student_id': student_id,
+                            'result': res_emit
+                        })
+                    if sid_default and send_audio:
+                        payload_target = {
+                            'session_id': sid or self.stream_name,
                             'stream_name': self.stream_name,
                             'result': res_emit
                         }
-                        now = time.time()
-                        if _safe_emit('audio_emotion_result', payload):
-                            if (now - last_emit) > 1.0:
-                                _log_debug(f"[RTSP/AUDIO] 默认命名空间 audio_emotion_result: stream={self.stream_name}, dom={res.get('dominant_emotion')}")
-                        # 备用事件名（与视频/心率一致的模式）
-                        _safe_emit('rtsp_audio_analysis', payload)
-                        # 广播到/monitor（并推送到房间 stream:<name> 的学生音频事件）
-                        _safe_emit('audio_emotion_result', payload, namespace='/monitor')
-                        _safe_emit('rtsp_audio_analysis', payload, namespace='/monitor')
-                        room = f"stream:{self.stream_name}"
-                        _safe_emit('student.audio', payload, room=room, namespace='/monitor')
-                        # 学生定向/教师事件
-                        if _session_mapper is not None:
-                            info = _session_mapper(self.stream_name) or {}
-                            sid = info.get('session_id')
-                            student_id = info.get('student_id')
-                            sid_default = info.get('sid_default')
-                            # 向后端发送“音频情绪”检查点（节流）
-                        # 保底写入：若未映射到学生会话ID，则使用 stream_name 作为会话键，确保缓冲有数据
-                        if sid:
-                            ensure_session_created(sid)
-                            _maybe_send_checkpoint(sid, 'audio_emotion', {
-                                'dominant_emotion': res_emit.get('dominant_emotion'),
-                                'confidence': res_emit.get('confidence'),
-                                'emotions': res_emit.get('emotions'),
-                            })
-                        else:
-                            ensure_session_created(self.stream_name)
-                            _maybe_send_checkpoint(self.stream_name, 'audio_emotion', {
-                                'dominant_emotion': res_emit.get('dominant_emotion'),
-                                'confidence': res_emit.get('confidence'),
-                                'emotions': res_emit.get('emotions'),
-                            })
-                            sid_monitor = info.get('sid_monitor')
-                            if sid:
-                                _safe_emit('student_audio_emotion_result', {
-                                    'session_id': sid,
-                                    'student_id': student_id,
-                                    'result': res_emit
-                                })
-                            if sid_default:
-                                payload_target = dict(payload)
-                                if sid:
-                                    payload_target['session_id'] = sid
-                                if _safe_emit('audio_emotion_result', payload_target, room=sid_default):
-                                    _log_debug(f"[RTSP/AUDIO] 定向推送到默认命名空间 audio_emotion_result: sid_default={sid_default}")
-                            if sid_monitor:
-                                # 定向推送到/monitor 上该浏览器连接
-                                if _safe_emit('audio_emotion_result', payload, room=sid_monitor, namespace='/monitor'):
-                                    _log_debug(f"[RTSP/AUDIO] 定向推送到/monitor audio_emotion_result: sid_monitor={sid_monitor}")
-                        last_emit = now
-                    except Exception as e:
-                        _log_warn(f"[RTSP/AUDIO] 分析失败: {e}")
+                        if _safe_emit('audio_emotion_result', payload_target, room=sid_default) and _DEBUG:
+                            _log_debug(f"[RTSP/AUDIO] 定向推送到默认命名空间 audio_emotion_result: sid_default={sid_default}")
+                    if sid_monitor and send_audio:
+                        # 定向推送到/monitor 上该浏览器连接
+                        if _safe_emit('audio_emotion_result', payload, room=sid_monitor, namespace='/monitor') and _DEBUG:
+                            _log_debug(f"[RTSP/AUDIO] 定向推送到/monitor audio_emotion_result: sid_monitor={sid_monitor}")
+                    last_emit = now
+                except Exception as e:
+                    _log_warn(f"[RTSP/AUDIO] 分析失败: {e}")
+        except Exception as e:
+            _log_warn(f"[RTSP/AUDIO] 音频线程异常退出: {e}")
         finally:
-            if self._ff_proc_audio is not None:
-                try:
-                    self._ff_proc_audio.kill()
-                except Exception:
-                    pass
-                self._ff_proc_audio = None
+            self._publish_status(audio_started=False)
+            _pop_app_context(app_ctx)
+
+    def _audio_ring_write(self, data: bytes):
+        ring = self._audio_ring
+        cap = len(ring)
+        n = len(data)
+        if n > cap:
+            data = data[-cap:]
+            n = cap
+        # 缓冲已满时丢弃最旧的数据（按整样本对齐）
+        overflow = (self._audio_w - self._audio_r) + n - cap
+        if overflow > 0:
+            self._audio_r += overflow + (overflow & 1)
+        pos = self._audio_w % cap
+        first = min(n, cap - pos)
+        ring[pos:pos + first] = data[:first]
+        if first < n:
+            ring[:n - first] = data[first:]
+        self._audio_w += n
+
+    def _audio_ring_take(self, nbytes: int) -> np.ndarray:
+        """取出 nbytes 字节的 s16le 样本（调用方保证已有足够数据）"""
+        ring = self._audio_ring
+        cap = len(ring)
+        pos = self._audio_r % cap
+        self._audio_r += nbytes
+        if pos + nbytes <= cap:
+            # 连续区间直接在环形缓冲上建视图，后续 astype 会生成独立副本
+            return np.frombuffer(ring, dtype=np.int16, count=nbytes // 2, offset=pos)
+        first = cap - pos
+        return np.concatenate((
+            np.frombuffer(ring, dtype=np.int16, count=first // 2, offset=pos),
+            np.frombuffer(ring, dtype=np.int16, count=(nbytes - first) // 2),
+        ))
+
+    def _resize_into(self, frame: np.ndarray, new_w: int, new_h: int) -> np.ndarray:
+        h, w = frame.shape[:2]
+        # 恰好缩小一半（如1280->640）走高斯金字塔 pyrDown，其余用 INTER_AREA（缩小时质量更好且有SIMD路径）
+        half = new_w == (w + 1) // 2
+        if half:
+            new_h = (h + 1) // 2
+        buf = self._fb.ensure('resized_bgr', (new_h, new_w, 3))
+        if half:
+            cv2.pyrDown(frame, dst=buf, dstsize=(new_w, new_h))
+        else:
+            cv2.resize(frame, (new_w, new_h), dst=buf, interpolation=cv2.INTER_AREA)
+        return buf
+
+    def _to_rgb(self, frame: np.ndarray) -> np.ndarray:
+        """OpenCV兜底路径输出BGR，读帧后立即转为RGB写入预分配缓冲"""
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._fb.ensure('rgb', frame.shape))
+
+    def _read_latest(self, cap):
+        """OpenCV路径：grab 掉缓冲中积压的旧帧，只 retrieve 最新一帧"""
+        if not cap.grab():
+            return False, None
+        t0 = time.monotonic()
+        while (time.monotonic() - t0) < _DRAIN_DEADLINE_SEC and cap.grab():
+            pass
+        return cap.retrieve()
+
+    def _wait_ff_readable(self, fd: int, mid_frame: bool) -> bool:
+        """等待视频管道可读：帧起始处最多等 _FF_READ_TIMEOUT_SEC；帧读到一半时最多等 _STALL_RECONNECT_SEC。停止时立即返回 False"""
+        deadline = time.monotonic() + (_STALL_RECONNECT_SEC if mid_frame else _FF_READ_TIMEOUT_SEC)
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if select.select([fd], [], [], min(remaining, _FF_READ_TIMEOUT_SEC))[0]:
+                return True
+        return False
+
+    def _abort_partial_frame(self, got: int) -> bool:
+        """读帧超时：帧读到一半时管道中的帧边界已错位，结束FFmpeg进程，由 run() 按进程退出重启"""
+        if got and self._ff_proc is not None:
+            try:
+                self._ff_proc.kill()
+            except Exception:
+                pass
+        return False
+
+    def _read_ffmpeg_raw(self) -> bool:
+        """读满一帧到 self._ff_buf（处理短读）；EOF、超时或停止时返回 False
+
+        每次读取前先 select 等待管道可读，FFmpeg 卡住不出帧时不会无限阻塞，主循环的断流检查与 stop() 都能生效。
+        """
+        view = self._ff_view
+        size = len(view)
+        got = 0
+        src = self._ff_video_out.fileno()
+        if self._ff_memfd is not None:
+            try:
+                while got < size:
+                    if not self._wait_ff_readable(src, got > 0):
+                        return self._abort_partial_frame(got)
+                    n = os.splice(src, self._ff_memfd, size - got, offset_dst=got)
+                    if not n:
+                        return False
+                    got += n
+                self._ff_frames += 1
+                return True
+            except OSError as e:
+                if got:
+                    raise
+                # 内核不支持管道到 memfd 的 splice：缓冲仍是同一块映射，改用 readinto 填充
+                _log_debug("[RTSP/FFmpeg] splice 不可用，改用 readinto: %s", e)
+                os.close(self._ff_memfd)
+                self._ff_memfd = None
+        while got < size:
+            if not self._wait_ff_readable(src, got > 0):
+                return self._abort_partial_frame(got)
+            n = self._ff_video_out.readinto(view[got:])
+            if not n:
+                return False
+            got += n
+        self._ff_frames += 1
+        return True
 
     def _read_ffmpeg_frame(self):
-        if self._ff_proc is None or self._ff_proc.stdout is None:
+        if self._ff_video_out is None:
             return False, None
         try:
-            size = self._ff_w * self._ff_h * 3
-            data = self._ff_proc.stdout.read(size)
-            if not data or len(data) < size:
+            if not self._read_ffmpeg_raw():
                 return False, None
-            frame = np.frombuffer(data, np.uint8).reshape((self._ff_h, self._ff_w, 3))
+            # 管道中还有积压帧时继续读取覆盖旧帧，只对最新一帧做颜色转换
+            fd = self._ff_video_out.fileno()
+            t0 = time.monotonic()
+            while (time.monotonic() - t0) < _DRAIN_DEADLINE_SEC and select.select([fd], [], [], 0)[0]:
+                if not self._read_ffmpeg_raw():
+                    # 覆盖读到一半遇到EOF，缓冲内容已不完整
+                    return False, None
+            # NV12 直接转 RGB（分析器所需格式），省去一次 BGR->RGB 全帧转换
+            frame = cv2.cvtColor(self._ff_nv12, cv2.COLOR_YUV2RGB_NV12,
+                                 dst=self._fb.ensure('rgb', (self._ff_h, self._ff_w, 3)))
             return True, frame
         except Exception:
             return False, None
 
+    def _publish_shared(self, frame: np.ndarray, ts: float):
+        if self.shm_name is None:
+            return
+        try:
+            shm = self._shm
+            if shm is None or shm.shape != frame.shape:
+                if shm is not None:
+                    shm.close()
+                shm = self._shm = _SharedFrame(self.shm_name, frame.shape)
+                self._publish_status(shm_name=self.shm_name)
+            shm.publish(frame, ts)
+        except Exception as e:
+            # 共享内存不可用（如容器未挂载 /dev/shm）时关闭该功能，不影响分析
+            _log_warn(f"[RTSP] 共享内存帧发布失败，已停用: {e}")
+            if self._shm is not None:
+                self._shm.close()
+                self._shm = None
+            self.shm_name = None
+            self._publish_status(shm_name=None)
+
+    def _analyze_worker(self):
+        """分析线程：从单槽队列取最新帧，与读帧线程解耦，分析耗时不再拖慢取流"""
+        app_ctx = _push_app_context()
+        held = []
+        try:
+            while not self._stop.is_set():
+                try:
+                    frame, now = self._analyze_q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self._analyze_frame(frame, now)
+                except Exception as e:
+                    _log_warn(f"[RTSP] 帧分析异常: {e}")
+                # 仍在批量推理中的帧继续持有，其余归还回收池
+                held.append(frame)
+                still = []
+                for buf in held:
+                    if id(buf) in self._pending:
+                        still.append(buf)
+                    else:
+                        self._frame_pool.append(buf)
+                held = still
+        finally:
+            _pop_app_context(app_ctx)
+
+    def _on_batch_result(self, frame: np.ndarray, res: Optional[Dict[str, Any]], cost_ms: float):
+        """批处理线程回调：更新最近结果与耗时EMA，并释放帧缓冲"""
+        if res:
+            self._last_result = res
+        if cost_ms > 0:
+            self._analyze_ms_ema = cost_ms if self._analyze_ms_ema == 0.0 else 0.2 * cost_ms + 0.8 * self._analyze_ms_ema
+        self._pending.pop(id(frame), None)
+
+    def _scene_changed(self, rgb: np.ndarray, now: float) -> bool:
+        """与上一帧缩略图的平均绝对差低于阈值、且上次推理不足 _SCENE_MAX_SKIP_SEC 时视为未变化"""
+        cur, prev = self._thumbs
+        cv2.resize(rgb, (32, 32), dst=cur, interpolation=cv2.INTER_AREA)
+        self._thumbs.reverse()
+        if not self._thumb_valid:
+            self._thumb_valid = True
+            return True
+        if (now - self._last_submit_ts) >= _SCENE_MAX_SKIP_SEC:
+            return True
+        return cv2.norm(cur, prev, cv2.NORM_L1) / cur.size >= _SCENE_DIFF_THRESHOLD
+
+    def _analyze_frame(self, rgb: np.ndarray, now: float):
+        """分析一帧（DeepFace + PPG）并推送结果；在分析线程中执行
+
+        rgb 为读帧线程移交的独立 RGB 副本，可直接提交批量推理，并在 DeepFace 与 PPG 之间复用。
+        """
+        result = {
+            'timestamp': now,
+            'dominant_emotion': 'unknown',
+            'confidence': 0.0
+        }
+        # 提交到跨流批量推理（不等待结果）；在途帧数受限，推理跟不上时跳过提交，不无限积压
+        if len(self._pending) < _INFER_BATCH and self._scene_changed(rgb, now):
+            self._last_submit_ts = now
+            self._pending[id(rgb)] = rgb
+            try:
+                self._batcher.submit(rgb, self._on_batch_result)
+            except Exception:
+                self._pending.pop(id(rgb), None)
+        if self._last_result:
+            result.update(self._last_result)
+        face_detected = bool(result.get('face_detected', False))
+
+        # 限频发送：间隔跟随分析耗时（留20%余量），分析快时提高频率，慢时避免积压
+        interval = max(_ANALYZE_MIN_INTERVAL, self._analyze_ms_ema / 1000.0 * 1.2)
+        if _socketio is not None and (now - self._last_emit) > interval:
+            payload = {
+                'session_id': self.stream_name,
+                'stream_name': self.stream_name,
+                'result': result,
+                'video_timestamp': now
+            }
+            # 更新HTTP轮询可读的最新状态（视频）
+            try:
+                _update_state(self.stream_name, 'video', result)
+            except Exception:
+                pass
+            # 结果未变化时仅在保活间隔到期后推送（状态缓存与检查点照常更新）
+            send_video = self._should_emit('video', (
+                result.get('dominant_emotion'), round(result.get('confidence') or 0.0, 2), face_detected
+            ), now)
+            if send_video:
+                # 广播给默认命名空间与/monitor的所有客户端（限频打印）
+                if _emit_many('video_emotion_result', payload, _BROADCAST_TARGETS):
+                    if _DEBUG and (now - self._last_diag) > 2.0:
+                        _log_debug("[RTSP] ✅ 广播 video_emotion_result: stream=%s, dom=%s", self.stream_name, result.get('dominant_emotion'))
+
+                # 备用事件名（仅/monitor有订阅）
+                _emit_many('rtsp_video_analysis', payload, _MONITOR_ONLY_TARGETS)
+
+                # 发送到特定房间（保留房间机制）
+                if _emit_many('student.emotion', payload, self._room_targets):
+                    if _DEBUG and (now - self._last_diag) > 1.5:
+                        _log_debug("[RTSP] 已发送 student.emotion 至房间: stream:%s", self.stream_name)
+
+            # 同步转发给教师端（student_* 事件），需要将 stream_name 映射为学生会话ID
+            # 映射每个发送周期只取一次，视频与心率分支共用
+            info = self._get_mapping(now)
+            sid = info.get('session_id')
+            student_id = info.get('student_id')
+            sid_default = info.get('sid_default')
+            # 本周期需要转发给教师端的结果，周期末尾合并为一个事件发送
+            combined = {}
+            if info:
+                try:
+                    if sid and send_video:
+                        combined['video'] = result
+                        if _LEGACY_STUDENT_EVENTS:
+                            _safe_emit('student_video_emotion_result', {
+                                'session_id': sid,
+                                'student_id': student_id,
+                                'result': result
+                            })
+                    # 关键：复用本机检测通路，定向推送到默认命名空间的特定浏览器连接
+                    if sid_default and send_video:
+                        payload_target = {
+                            'session_id': sid or self.stream_name,  # 与当前监控学生会话ID对齐
+                            'stream_name': self.stream_name,
+                            'result': result,
+                            'video_timestamp': now
+                        }
+                        if _safe_emit('video_emotion_result', payload_target, room=sid_default) and _DEBUG:
+                            _log_debug("[RTSP] 🎯 定向推送到默认命名空间 video_emotion_result: sid_default=%s", sid_default)
+                    # 发送视频情绪检查点：优先按会话ID；无会话ID则以 stream_name 缓存
+                    self._checkpoint(sid, 'video_emotion', {
+                        'dominant_emotion': result.get('dominant_emotion'),
+                        'confidence': result.get('confidence'),
+                        'emotions': result.get('emotions'),
+                        'face_detected': face_detected,
+                    })
+                except Exception:
+                    pass
+
+            # 触发 PPG 心率检测并发送结果（轻量频率，不强制每帧）
+            if enhanced_ppg_detector is not None:
+                try:
+                    hr = enhanced_ppg_detector.process_frame(rgb, face_detected)
+                    hr['timestamp'] = now
+                    base_hr_payload = {
+                        'session_id': self.stream_name,
+                        'stream_name': self.stream_name,
+                        'result': hr
+                    }
+                    # 更新HTTP轮询可读的最新状态（心率）
+                    try:
+                        _update_state(self.stream_name, 'heart', hr)
+                    except Exception:
+                        pass
+                    # 心率按整数BPM量化后比较
+                    send_heart = self._should_emit('heart', (
+                        int(round(hr.get('heart_rate') or hr.get('hr_bpm') or 0)), hr.get('detection_state')
+                    ), now)
+                    if send_heart:
+                        # 广播给默认命名空间与/monitor的所有客户端（/monitor 为关键修复）
+                        if _emit_many('heart_rate_result', base_hr_payload, _BROADCAST_TARGETS):
+                            if _DEBUG and (now - self._last_diag) > 2.0:
+                                _log_debug("[RTSP] ✅ 广播 heart_rate_result: stream=%s, state=%s", self.stream_name, hr.get('detection_state'))
+
+                        # 备用事件名（仅/monitor有订阅）
+                        _emit_many('rtsp_heart_rate_analysis', base_hr_payload, _MONITOR_ONLY_TARGETS)
+
+                        # 发送到特定房间（保留房间机制）
+                        if _emit_many('student.heart_rate', base_hr_payload, self._room_targets):
+                            if _DEBUG and (now - self._last_diag) > 1.5:
+                                _log_debug(f"[RTSP] 已发送 student.heart_rate 至房间: stream:{self.stream_name}")
+                    if info:
+                        if sid and send_heart:
+                            combined['heart_rate'] = hr
+                            if _LEGACY_STUDENT_EVENTS:
+                                _safe_emit('student_heart_rate_result', {
+                                    'session_id': sid,
+                                    'student_id': student_id,
+                                    'result': hr
+                                })
+                        # 关键：复用本机检测通路，定向推送到默认命名空间的特定浏览器连接
+                        if sid_default and send_heart:
+                            payload_target = {
+                                'session_id': sid or self.stream_name,
+                                'stream_name': self.stream_name,
+                                'result': hr
+                            }
+                            if _safe_emit('heart_rate_result', payload_target, room=sid_default) and _DEBUG:
+                                _log_debug(f"[RTSP] 定向推送到默认命名空间 heart_rate_result: sid_default={sid_default}")
+                        # 发送心率检查点，以便后端实时入库：优先按会话ID；无会话ID则以 stream_name 缓存
+                        self._checkpoint(sid, 'ppg_detector', {
+                            'heart_rate': hr.get('heart_rate') or hr.get('hr_bpm'),
+                            'confidence': hr.get('confidence'),
+                            'detection_state': hr.get('detection_state') or hr.get('state'),
+                        })
+                except Exception:
+                    pass
+            if combined:
+                combined['session_id'] = sid
+                combined['student_id'] = student_id
+                if _safe_emit('student_combined_result', combined) and _DEBUG and (now - self._last_diag) > 1.5:
+                    _log_debug("[RTSP] 已转发 student_combined_result: sid=%s, student_id=%s, parts=%s",
+                               sid, student_id, [k for k in ('video', 'heart_rate') if k in combined])
+            self._last_emit = now
+            if (now - self._last_diag) > 2.0:
+                self._last_diag = now
+
     def run(self):
         backoff = 0.5
         cap = None
-        last_emit = 0.0
         self.last_frame_ts = time.time()
-        empty_reads = 0
         last_diag = 0.0
 
         # 持续重试打开，直到成功或被停止
@@ -418,7 +1272,7 @@ class _ConsumerThread(threading.Thread):
             cap = self._open_capture()
             if cap is None:
                 _log_warn(f"[RTSP] 尚未可用，等待后重试: {self.rtsp_url}")
-                time.sleep(backoff)
+                self._stop.wait(backoff)
                 backoff = min(backoff * 2, 5.0)
 
         if self._stop.is_set():
@@ -426,256 +1280,133 @@ class _ConsumerThread(threading.Thread):
 
         _log_info(f"[RTSP] 开始消费: {self.rtsp_url}")
         self.connected = True
-        # 启动音频分析线程（与视频并行）
+        # 最近一次读到帧（或完成重连）的时间；批处理使“迭代次数”和“帧数”脱钩，按墙钟判断断流
+        last_ok_ts = time.time()
+        # 优先使用FFmpeg同时解码音视频（单一RTSP会话），OpenCV仅作兜底
+        self._start_ffmpeg()
+        # 启动音频读取与分析线程（与视频并行）
         try:
+            if self._audio_reader_thread is None or not self._audio_reader_thread.is_alive():
+                self._audio_reader_thread = threading.Thread(target=self._audio_reader, daemon=True)
+                self._audio_reader_thread.start()
             if self._audio_thread is None or not self._audio_thread.is_alive():
                 self._audio_thread = threading.Thread(target=self._audio_worker, daemon=True)
                 self._audio_thread.start()
+                self._publish_status(audio_started=True)
         except Exception as _e:
             _log_warn(f"[RTSP] 启动音频线程失败: {_e}")
+        if self._analyze_thread is None or not self._analyze_thread.is_alive():
+            self._analyze_thread = threading.Thread(target=self._analyze_worker, daemon=True)
+            self._analyze_thread.start()
         try:
             while not self._stop.is_set():
-                ok, frame = (cap.read() if cap is not None else (False, None))
-                if not ok and self._ff_proc is not None:
+                if self._ff_proc is not None:
+                    # FFmpeg视频管道必须持续读取，否则会阻塞同一进程的音频输出
                     ok, frame = self._read_ffmpeg_frame()
-                if not ok or frame is None:
-                    empty_reads += 1
-                    # 连续读空帧，重连
-                    if empty_reads >= 30:  # ~1.5s
+                    is_bgr = False
+                    if ok and cap is not None:
+                        # FFmpeg已出帧，释放多余的OpenCV RTSP连接
                         try:
                             cap.release()
                         except Exception:
                             pass
                         cap = None
+                else:
+                    ok, frame = (self._read_latest(cap) if cap is not None else (False, None))
+                    is_bgr = True
+                if not ok or frame is None:
+                    # FFmpeg 管道读取带超时：已出过帧的进程退出后立即重启，不再空等断流计时
+                    ff_exited = (self._ff_proc is not None and self._ff_frames > 0
+                                 and self._ff_proc.poll() is not None)
+                    # 刚启动、仍在连接RTSP的进程尚未出帧，不算断流
+                    ff_starting = (self._ff_proc is not None and self._ff_frames == 0
+                                   and self._ff_proc.poll() is None
+                                   and (time.time() - self._ff_start_ts) < _FF_START_GRACE_SEC)
+                    # 持续读不到帧，重连
+                    if ff_exited or (not ff_starting and (time.time() - last_ok_ts) >= _STALL_RECONNECT_SEC):
+                        if cap is not None:
+                            try:
+                                cap.release()
+                            except Exception:
+                                pass
+                        cap = None
                         self.connected = False
                         backoff = 0.5
-                        # 启动FFmpeg作为备用解码
-                        if self._ff_proc is None:
-                            self._start_ffmpeg()
+                        # 重启FFmpeg（已退出或长时间不出帧）；若进程未出帧即退出，可能是流中无音轨，本次改为仅视频输出。
+                        # 仅视频只用于下一次启动：之后再重连时恢复带音频，推流端重启后音轨可能已经恢复
+                        if self._ff_proc is not None:
+                            if self._ff_proc.poll() is not None and self._ff_frames == 0 and self._ff_with_audio:
+                                _log_warn(f"[RTSP/FFmpeg] 进程未出帧即退出，本次改为仅解码视频: {self.stream_name}")
+                                self._ff_with_audio = False
+                            else:
+                                self._ff_with_audio = True
+                            self._stop_ffmpeg()
+                        if self._ff_proc is None and self._start_ffmpeg():
+                            self.connected = True
+                            last_ok_ts = time.time()
+                            continue
                         while not self._stop.is_set() and cap is None:
                             cap = self._open_capture()
                             if cap is None:
                                 if (time.time() - last_diag) > 2.0:
                                     _log_warn(f"[RTSP] 读取失败，正在重连: {self.rtsp_url}")
                                     last_diag = time.time()
-                                time.sleep(backoff)
+                                self._stop.wait(backoff)
                                 backoff = min(backoff * 2, 5.0)
                         if cap is not None:
                             self.connected = True
-                        empty_reads = 0
+                        last_ok_ts = time.time()
                         continue
-                    time.sleep(0.05)
+                    # OpenCV 无可等待的文件描述符，短暂等待；停止信号可立即唤醒
+                    self._stop.wait(0.05)
                     continue
-                empty_reads = 0
-                self.last_frame_ts = time.time()
+                # 每次迭代只取一次时间，视频与PPG分支共用（epoch秒，前端按数值时间戳解析）
+                now = time.time()
+                self.last_frame_ts = now
+                last_ok_ts = now
 
                 # 周期性诊断：确认帧在读取
-                if (self.last_frame_ts - last_diag) > 2.0:
-                    print(f"[RTSP] 已读取视频帧: stream={self.stream_name}, ts={self.last_frame_ts:.2f}")
-                    last_diag = self.last_frame_ts
+                if _DEBUG and (now - last_diag) > 2.0:
+                    _log_debug("[RTSP] 已读取视频帧: stream=%s, ts=%.2f", self.stream_name, now)
+                    last_diag = now
 
-                # 降采样处理，降低开销
+                # 降采样处理，降低开销（FFmpeg输出已是640宽，直接跳过）
                 h, w = frame.shape[:2]
-                scale = min(1.0, 640.0 / max(1, w))
-                if scale < 1.0:
-                    frame = cv2.resize(frame, (int(w*scale), int(h*scale)))
-
-                # 分析（容错）
-                result = {
-                    'timestamp': datetime.now().isoformat(),
-                    'dominant_emotion': 'unknown',
-                    'confidence': 0.0
-                }
-                try:
-                    deepface_analyzer = self.model_manager.get_deepface_analyzer()
-                    if deepface_analyzer is not None:
-                        if hasattr(deepface_analyzer, 'is_initialized') and not deepface_analyzer.is_initialized:
-                            if hasattr(deepface_analyzer, 'initialize'):
-                                deepface_analyzer.initialize()
-                        # BGR -> RGB
-                        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        r = deepface_analyzer.analyze(rgb)
-                        result.update(r)
-                except Exception:
-                    # 分析失败不阻断
-                    pass
+                if w > 640:
+                    frame = self._resize_into(frame, 640, h * 640 // w)
+                # 统一为 RGB：FFmpeg 路径解码时已直接输出 RGB，OpenCV 路径在缩放后转换
+                if is_bgr:
+                    frame = self._to_rgb(frame)
 
-                # 限频发送（每秒最多 2 次，降低频率避免前端渲染问题）
-                now = time.time()
-                if _socketio is not None and (now - last_emit) > 0.5:
-                    payload = {
-                        'session_id': self.stream_name,
-                        'stream_name': self.stream_name,
-                        'result': result,
-                        'video_timestamp': now
-                    }
-                    # 更新HTTP轮询可读的最新状态（视频）
-                    try:
-                        _update_state(self.stream_name, 'video', result)
-                    except Exception:
-                        pass
-                    # 广播给默认命名空间的所有客户端 - 使用应用上下文（限频打印）
-                    if _safe_emit('video_emotion_result', payload):
-                        if (now - last_diag) > 2.0:
-                            print(f"[RTSP] ✅ 广播默认NS video_emotion_result: stream={self.stream_name}, dom={result.get('dominant_emotion')}")
-                    
-                    # 额外确认：也尝试广播到所有连接的客户端
-                    if _safe_emit('rtsp_video_analysis', payload):
-                        if (now - last_diag) > 2.0:
-                            print(f"[RTSP] ✅ 额外广播 rtsp_video_analysis")
-
-                    # 同时广播到监控命名空间（保留）
-                    if _safe_emit('video_emotion_result', payload, namespace='/monitor'):
-                        if (now - last_diag) > 2.0:
-                            print(f"[RTSP] ✅ 广播/monitor video_emotion_result: stream={self.stream_name}")
-                    
-                    # 额外确认：也尝试在monitor命名空间广播备用事件
-                    if _safe_emit('rtsp_video_analysis', payload, namespace='/monitor'):
-                        if (now - last_diag) > 2.0:
-                            print(f"[RTSP] ✅ /monitor 额外广播 rtsp_video_analysis")
-
-                    # 发送到特定房间（保留房间机制）
-                    room = f"stream:{self.stream_name}"
-                    if _safe_emit('student.emotion', payload, room=room, namespace='/monitor'):
-                        if (now - last_diag) > 1.5:
-                            print(f"[RTSP] 已发送 student.emotion 至房间: {room}")
-
-                    # 同步转发给教师端（student_* 事件），需要将 stream_name 映射为学生会话ID
-                    if _session_mapper is not None:
-                        try:
-                            info = _session_mapper(self.stream_name)
-                            if info and isinstance(info, dict):
-                                sid = info.get('session_id')
-                                student_id = info.get('student_id')
-                                sid_default = info.get('sid_default')
-                                if sid:
-                                    if _safe_emit('student_video_emotion_result', {
-                                        'session_id': sid,
-                                        'student_id': student_id,
-                                        'result': result
-                                    }):
-                                        if (now - last_diag) > 1.5:
-                                            print(f"[RTSP] 已转发 student_video_emotion_result: sid={sid}, student_id={student_id}")
-                                # 关键：复用本机检测通路，定向推送到默认命名空间的特定浏览器连接
-                                if sid_default:
-                                    payload_target = dict(payload)
-                                    if sid:
-                                        payload_target['session_id'] = sid  # 与当前监控学生会话ID对齐
-                                    if _safe_emit('video_emotion_result', payload_target, room=sid_default):
-                                        print(f"[RTSP] 🎯 定向推送到默认命名空间 video_emotion_result: sid_default={sid_default}")
-                                # 发送视频情绪检查点（节流，1s一次）
-                                # 发送视频情绪检查点：优先按会话ID；无会话ID则以 stream_name 缓存
-                                if sid:
-                                    ensure_session_created(sid)
-                                    _maybe_send_checkpoint(sid, 'video_emotion', {
-                                        'dominant_emotion': result.get('dominant_emotion'),
-                                        'confidence': result.get('confidence'),
-                                        'emotions': result.get('emotions'),
-                                        'face_detected': result.get('face_detected'),
-                                    })
-                                else:
-                                    ensure_session_created(self.stream_name)
-                                    _maybe_send_checkpoint(self.stream_name, 'video_emotion', {
-                                        'dominant_emotion': result.get('dominant_emotion'),
-                                        'confidence': result.get('confidence'),
-                                        'emotions': result.get('emotions'),
-                                        'face_detected': result.get('face_detected'),
-                                    })
-                        except Exception:
-                            pass
+                self._publish_shared(frame, now)
 
-                    # 触发 PPG 心率检测并发送结果（轻量频率，不强制每帧）
-                    try:
-                        from models.enhanced_ppg_detector import enhanced_ppg_detector
-                        hr = enhanced_ppg_detector.process_frame(rgb if 'rgb' in locals() else frame, bool(result.get('face_detected')))
-                        hr['timestamp'] = datetime.now().isoformat()
-                        base_hr_payload = {
-                            'session_id': self.stream_name,
-                            'stream_name': self.stream_name,
-                            'result': hr
-                        }
-                        # 更新HTTP轮询可读的最新状态（心率）
-                        try:
-                            _update_state(self.stream_name, 'heart', hr)
-                        except Exception:
-                            pass
-                        # 广播给默认命名空间的所有客户端 - 使用应用上下文
-                        if _safe_emit('heart_rate_result', base_hr_payload):
-                            if (now - last_diag) > 2.0:
-                                print(f"[RTSP] ✅ 广播默认NS heart_rate_result: stream={self.stream_name}, state={hr.get('detection_state')}")
-                        
-                        # 额外确认：也尝试广播心率分析事件
-                        if _safe_emit('rtsp_heart_rate_analysis', base_hr_payload):
-                            if (now - last_diag) > 2.0:
-                                print(f"[RTSP] ✅ 额外广播 rtsp_heart_rate_analysis")
-                        
-                        # 同时广播到监控命名空间（关键修复）
-                        if _safe_emit('heart_rate_result', base_hr_payload, namespace='/monitor'):
-                            if (now - last_diag) > 2.0:
-                                print(f"[RTSP] ✅ 广播/monitor heart_rate_result: stream={self.stream_name}")
-                        
-                        # 额外确认：也尝试在monitor命名空间广播备用事件
-                        if _safe_emit('rtsp_heart_rate_analysis', base_hr_payload, namespace='/monitor'):
-                            if (now - last_diag) > 2.0:
-                                _log_debug(f"[RTSP] /monitor 额外广播 rtsp_heart_rate_analysis")
-                            
-                        # 发送到特定房间（保留房间机制）
-                        room = f"stream:{self.stream_name}"
-                        if _safe_emit('student.heart_rate', base_hr_payload, room=room, namespace='/monitor'):
-                            if (now - last_diag) > 1.5:
-                                _log_debug(f"[RTSP] 已发送 student.heart_rate 至房间: {room}")
-                        if _session_mapper is not None:
-                            info = _session_mapper(self.stream_name)
-                            if info and isinstance(info, dict):
-                                sid = info.get('session_id')
-                                student_id = info.get('student_id')
-                                sid_default = info.get('sid_default')
-                                if sid:
-                                    if _safe_emit('student_heart_rate_result', {
-                                        'session_id': sid,
-                                        'student_id': student_id,
-                                        'result': hr
-                                    }):
-                                        if (now - last_diag) > 1.5:
-                                            _log_debug(f"[RTSP] 已转发 student_heart_rate_result: sid={sid}, hr={hr.get('heart_rate')}")
-                                # 关键：复用本机检测通路，定向推送到默认命名空间的特定浏览器连接
-                                if sid_default:
-                                    payload_target = dict(base_hr_payload)
-                                    if sid:
-                                        payload_target['session_id'] = sid
-                                    if _safe_emit('heart_rate_result', payload_target, room=sid_default):
-                                        _log_debug(f"[RTSP] 定向推送到默认命名空间 heart_rate_result: sid_default={sid_default}")
-                                # 发送心率检查点（节流），以便后端实时入库
-                                # 发送心率检查点：优先按会话ID；无会话ID则以 stream_name 缓存
-                                if sid:
-                                    ensure_session_created(sid)
-                                    _maybe_send_checkpoint(sid, 'ppg_detector', {
-                                        'heart_rate': hr.get('heart_rate') or hr.get('hr_bpm'),
-                                        'confidence': hr.get('confidence'),
-                                        'detection_state': hr.get('detection_state') or hr.get('state'),
-                                    })
-                                else:
-                                    ensure_session_created(self.stream_name)
-                                    _maybe_send_checkpoint(self.stream_name, 'ppg_detector', {
-                                        'heart_rate': hr.get('heart_rate') or hr.get('hr_bpm'),
-                                        'confidence': hr.get('confidence'),
-                                        'detection_state': hr.get('detection_state') or hr.get('state'),
-                                    })
-                    except Exception:
-                        pass
-                    last_emit = now
+                # 交给分析线程：单槽队列只保留最新帧（帧缓冲会被下一次读取覆盖，需复制到回收池中的缓冲）
+                buf = self._frame_pool.popleft() if self._frame_pool else None
+                if buf is None or buf.shape != frame.shape:
+                    buf = np.empty(frame.shape, dtype=np.uint8)
+                np.copyto(buf, frame)
+                item = (buf, now)
+                try:
+                    # 被替换掉的旧帧未交给分析线程，直接回收
+                    self._frame_pool.append(self._analyze_q.get_nowait()[0])
+                except queue.Empty:
+                    pass
+                try:
+                    self._analyze_q.put_nowait(item)
+                except queue.Full:
+                    pass
         finally:
             if cap is not None:
                 try:
                     cap.release()
                 except Exception:
                     pass
-            if self._ff_proc is not None:
-                try:
-                    self._ff_proc.kill()
-                except Exception:
-                    pass
-                self._ff_proc = None
+            self._stop_ffmpeg()
+            self._release_frame_buf()
+            if self._shm is not None:
+                self._shm.close()
+                self._shm = None
+                self._publish_status(shm_name=None)
             _log_info(f"[RTSP] 结束: {self.rtsp_url}")
             self.connected = False
 
@@ -686,8 +1417,11 @@ class _ConsumerThread(threading.Thread):
 class RTSPConsumerManager:
     def __init__(self, model_manager):
         self.model_manager = model_manager
+        # 写时复制：start/stop 在锁内构造新字典后整体替换，status() 等读取方直接读当前引用，无需加锁
         self._threads = {}
         self._lock = threading.Lock()
+        # 所有流共享一个批量推理器
+        self._batcher = _BatchAnalyzer(model_manager)
 
     def start(self, stream_name: str, rtsp_url: str) -> bool:
         key = stream_name
@@ -695,21 +1429,18 @@ class RTSPConsumerManager:
             th = self._threads.get(key)
             if th and th.is_alive():
                 # 已有消费者在运行
-                if getattr(th, 'rtsp_url', '') == rtsp_url:
+                if th.rtsp_url == rtsp_url:
                     return True
-                # URL 变化，先停止再重建
+                # URL 变化，先停止再重建（旧线程需先释放同名共享内存与RTSP连接）
                 try:
                     th.stop()
                     th.join(timeout=1.0)
                 except Exception:
                     pass
-                self._threads.pop(key, None)
-            elif th:
-                # 线程不在运行，清理
-                self._threads.pop(key, None)
-
-            th_new = _ConsumerThread(stream_name, rtsp_url, self.model_manager)
-            self._threads[key] = th_new
+            th_new = _ConsumerThread(stream_name, rtsp_url, self.model_manager, self._batcher)
+            threads = dict(self._threads)
+            threads[key] = th_new
+            self._threads = threads
             th_new.start()
             return True
 
@@ -717,27 +1448,39 @@ class RTSPConsumerManager:
         key = stream_name
         with self._lock:
             th = self._threads.get(key)
-            if th:
-                try:
-                    th.stop()
-                    th.join(timeout=1.0)
-                except Exception:
-                    pass
-                self._threads.pop(key, None)
-                return True
+            if not th:
+                return False
+            threads = dict(self._threads)
+            threads.pop(key, None)
+            self._threads = threads
+            th.stop()
+        # 在锁外等待线程退出，不阻塞其他流的启停与状态查询
+        try:
+            th.join(timeout=1.0)
+        except Exception:
+            pass
+        return True
+
+    def invalidate_mapping(self, stream_name: str) -> bool:
+        """通知对应消费者重新查询 stream_name -> 学生会话映射"""
+        th = self._threads.get(stream_name)
+        if th is None:
             return False
+        th.invalidate_mapping()
+        return True
 
     def status(self):
         now = time.time()
         info = {}
-        for k, th in self._threads.items():
-            info[k] = {
-                'connected': getattr(th, 'connected', False),
-                'last_frame_age_sec': (now - getattr(th, 'last_frame_ts', 0.0)) if getattr(th, 'last_frame_ts', 0.0) else None,
-                'rtsp_url': getattr(th, 'rtsp_url', ''),
-                'audio_started': getattr(th, '_audio_thread', None) is not None and getattr(th._audio_thread, 'is_alive', lambda: False)(),
-                'audio_bytes': getattr(th, '_audio_bytes_read', 0),
-                'audio_chunks': getattr(th, '_audio_chunks', 0),
-                'audio_last_age_sec': (now - getattr(th, '_audio_last_ts', 0.0)) if getattr(th, '_audio_last_ts', 0.0) else None,
-            }
+        for k, th in self._threads.items():  # 当前快照，迭代期间不会被修改
+            # 状态快照整体读取；逐帧/逐块变化的计数与时间戳为单次属性读取
+            last_frame_ts = th.last_frame_ts
+            audio_last_ts = th._audio_last_ts
+            info[k] = dict(
+                th._status_snapshot,
+                last_frame_age_sec=(now - last_frame_ts) if last_frame_ts else None,
+                audio_bytes=th._audio_bytes_read,
+                audio_chunks=th._audio_chunks,
+                audio_last_age_sec=(now - audio_last_ts) if audio_last_ts else None,
+            )
         return info
@@ -1796,7 +1796,8 @@ function updateTrendData(type, emotion, timestamp) {
     let parsed = null;
 
     if (timestamp) {
-        const candidate = new Date(timestamp);
+        // RTSP 推送的时间戳为 epoch 秒（浮点数），其余来源为 ISO 字符串
+        const candidate = new Date(typeof timestamp === 'number' ? timestamp * 1000 : timestamp);
         if (!Number.isNaN(candidate.getTime())) {
             parsed = candidate;
         }
@@ -3581,6 +3582,8 @@ function initStudentMonitoring() {
         socket.on('student_video_emotion_result', handleStudentVideoEmotionResult);
         socket.on('student_audio_emotion_result', handleStudentAudioEmotionResult);
         socket.on('student_heart_rate_result', handleStudentHeartRateResult);
+        // RTSP 通路将同一周期的视频情绪与心率合并为一个事件
+        socket.on('student_combined_result', handleStudentCombinedResult);
     }
 }
 
@@ -4678,6 +4681,17 @@ function handleStudentHeartRateResult(data) {
     }
 }
 
+function handleStudentCombinedResult(data) {
+    if (!data) return;
+    const base = { session_id: data.session_id, student_id: data.student_id };
+    if (data.video) {
+        handleStudentVideoEmotionResult({ ...base, result: data.video });
+    }
+    if (data.heart_rate) {
+        handleStudentHeartRateResult({ ...base, result: data.heart_rate });
+    }
+}
+
 // 工具函数
 function formatTime(timeString) {
     const date = new Date(timeString);
@@ -0,0 +1,80 @@
+"""
+心率统计内核与情绪类别编码
+报告生成时每道题都要算一遍心率均值/极值/趋势，这里用 numba 编译成单遍循环；
+未安装 numba 时退化为同一份纯 Python/numpy 实现，结果一致。
+"""
+
+import threading
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        # 兼容 @njit 与 @njit(cache=True) 两种写法
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(cache=True)
+def hr_stats(a):
+    """单遍计算 (平均, 最小值下标, 最大值下标)；a 为非空 float64 数组"""
+    lo = 0
+    hi = 0
+    total = 0.0
+    for i in range(a.shape[0]):
+        v = a[i]
+        total += v
+        if v < a[lo]:
+            lo = i
+        if v > a[hi]:
+            hi = i
+    return total / a.shape[0], lo, hi
+
+
+@njit(cache=True)
+def hr_trend(a, first, last):
+    """末段均值减首段均值；first/last 为首/末段样本数"""
+    n = a.shape[0]
+    head = 0.0
+    for i in range(first):
+        head += a[i]
+    tail = 0.0
+    for i in range(n - last, n):
+        tail += a[i]
+    return tail / last - head / first
+
+
+def to_array(values) -> np.ndarray:
+    """心率序列 -> 连续 float64 数组（已是数组时不再复制）"""
+    if isinstance(values, np.ndarray):
+        return np.ascontiguousarray(values, dtype=np.float64)
+    return np.fromiter(values, dtype=np.float64, count=len(values))
+
+
+# 情绪标签 -> int8 类别编码；覆盖面部/语音模型的标签，未知标签首次出现时追加
+EMOTION_LABELS = ['neutral', 'happy', 'sad', 'angry', 'fear', 'surprise', 'disgust',
+                  'fearful', 'surprised', 'disgusted', 'calm', 'other', 'unknown']
+EMOTION_CODES = {label: code for code, label in enumerate(EMOTION_LABELS)}
+_labels_lock = threading.Lock()
+
+
+def _emotion_code(label) -> int:
+    code = EMOTION_CODES.get(label)
+    if code is None:
+        with _labels_lock:
+            code = EMOTION_CODES.get(label)
+            if code is None:
+                if len(EMOTION_LABELS) > np.iinfo(np.int8).max:
+                    return EMOTION_CODES['unknown']
+                code = EMOTION_CODES[label] = len(EMOTION_LABELS)
+                EMOTION_LABELS.append(label)
+    return code
+
+
+def encode_emotions(samples, default: str) -> np.ndarray:
+    """情绪记录列表 -> int8 类别编码数组（缺少 dominant_emotion 时取 default）"""
+    return np.fromiter((_emotion_code(e.get('dominant_emotion', default)) for e in samples),
+                       dtype=np.int8, count=len(samples))
@@ -15,7 +15,7 @@ from PIL import Image
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models.model_manager import model_manager
-from utils.gpu_manager import gpu_manager
+from utils.gpu_manager import get_gpu_manager
 
 # 设置日志级别
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +28,7 @@ def test_gpu_manager():
     print("="*60)
     
     # 获取GPU状态
+    gpu_manager = get_gpu_manager()
     status = gpu_manager.get_gpu_status()
     print(f"GPU可用: {status['gpu_available']}")
     
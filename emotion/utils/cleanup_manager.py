@@ -4,22 +4,171 @@
 """
 
 import os
-import json
+import time
 import shutil
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# stat/unlink 并发线程数（系统调用期间释放GIL）；机械硬盘可设为 1 关闭并发
+_IO_WORKERS = int(os.environ.get('AI_CLEANUP_IO_WORKERS', '8') or 1)
+
+
+# 项目内临时文件的后缀（另有以 core. 开头的崩溃转储）
+_TEMP_SUFFIXES = ('.tmp', '.temp')
+
+# POSIX 下支持 unlinkat：打开父目录一次，之后按文件名删除，省去每个文件的完整路径解析
+_UNLINK_DIR_FD = os.unlink in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY')
+
+
+@contextmanager
+def _unlinker():
+    """批量删除文件：按父目录缓存目录 fd 走 unlinkat，退出时统一关闭；Windows 退化为 os.unlink"""
+    if not _UNLINK_DIR_FD:
+        yield os.unlink
+        return
+    fds = {}
+    lock = threading.Lock()
+
+    def unlink(path: str):
+        parent, name = os.path.split(path)
+        with lock:
+            dfd = fds.get(parent)
+            if dfd is None:
+                dfd = fds[parent] = os.open(parent or '.', os.O_RDONLY | os.O_DIRECTORY)
+        os.unlink(name, dir_fd=dfd)
+
+    try:
+        yield unlink
+    finally:
+        for dfd in fds.values():
+            os.close(dfd)
+
+
+def _parallel_map(fn, items: list) -> list:
+    """用线程池并发执行逐文件的系统调用，返回与 items 对应的结果"""
+    if _IO_WORKERS <= 1 or len(items) < 2:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(_IO_WORKERS, len(items)), thread_name_prefix='cleanup-io') as pool:
+        return list(pool.map(fn, items))
+
+
+# 流式处理时每批提交给线程池的条目数，限制同时驻留内存的 DirEntry 数量
+_STREAM_BATCH = 1024
+
+
+def _parallel_count(fn, items) -> int:
+    """流式并发执行 fn，返回结果为真的个数；items 可为生成器，分批消费不整体物化"""
+    if _IO_WORKERS <= 1:
+        return sum(1 for item in items if fn(item))
+    count = 0
+    batch = []
+    with ThreadPoolExecutor(max_workers=_IO_WORKERS, thread_name_prefix='cleanup-io') as pool:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= _STREAM_BATCH:
+                count += sum(pool.map(fn, batch))
+                batch = []
+        if batch:
+            count += sum(pool.map(fn, batch))
+    return count
+
+
+def _walk(directory):
+    """递归遍历目录下的所有条目（os.DirEntry，含子目录本身），逐个产出"""
+    stack = [directory]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    yield entry
+        except OSError as e:
+            logger.warning("读取目录失败: %s", e)
+
+
+def _files(directory, recursive: bool = False, suffix: str = None):
+    """逐个产出目录下的普通文件条目；不跟随符号链接，is_file 直接由 getdents 的 d_type 判断，无需额外 stat"""
+    if not recursive:
+        with os.scandir(directory) as it:
+            yield from (e for e in it if e.is_file(follow_symlinks=False) and (suffix is None or e.name.endswith(suffix)))
+        return
+    for e in _walk(directory):
+        if e.is_file(follow_symlinks=False) and (suffix is None or e.name.endswith(suffix)):
+            yield e
+
+
+def _walk_stats(roots) -> dict:
+    """
+    统计若干目录的文件数/条目数/总字节数；互相嵌套的目录共用一次遍历，每个 inode 只 stat 一次
+    返回 {root: {'files', 'entries', 'bytes', 'json'}}，json 为根目录下一层的 .json 文件数
+    """
+    stats = {root: {'files': 0, 'entries': 0, 'bytes': 0, 'json': 0} for root in roots}
+    paths = {os.path.abspath(root): root for root in roots if os.path.isdir(root)}
+    tops = [p for p in paths if not any(p.startswith(q + os.sep) for q in paths)]
+    for top in tops:
+        stack = [(top, (paths[top],))]
+        while stack:
+            path, tags = stack.pop()
+            own = paths.get(path)
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        is_file = entry.is_file(follow_symlinks=False)
+                        size = _file_size(entry) if is_file else 0
+                        for tag in tags:
+                            counter = stats[tag]
+                            counter['entries'] += 1
+                            if is_file:
+                                counter['files'] += 1
+                                counter['bytes'] += size
+                        if is_file and own is not None and entry.name.endswith('.json'):
+                            stats[own]['json'] += 1
+                        if entry.is_dir(follow_symlinks=False):
+                            sub = paths.get(entry.path)
+                            stack.append((entry.path, tags + (sub,) if sub is not None else tags))
+            except OSError as e:
+                logger.warning("读取目录失败: %s", e)
+    return stats
+
+
+def _mtime_or_none(entry: os.DirEntry):
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime
+    except OSError as e:
+        logger.warning("读取文件信息失败 %s: %s", entry.path, e)
+        return None
+
+
+def _file_size(entry: os.DirEntry) -> int:
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return 0
+
+
 class CleanupManager:
     """系统清理管理器"""
     
+    # 存储信息缓存有效期（秒）；仪表盘轮询时避免重复遍历目录
+    STORAGE_INFO_TTL = 5.0
+    
     def __init__(self):
         self.sessions_dir = Path(Config.SESSIONS_FOLDER)
         self.uploads_dir = Path(Config.UPLOAD_FOLDER)
-        self.temp_dirs = []
+        # 项目内可能残留临时文件的目录（只扫描一层）：原子写入的 *.tmp 与进程崩溃的 core.*
+        project_root = Path(__file__).parent.parent
+        data_dir = Path(Config.DATA_FOLDER)
+        self.temp_dirs = [project_root, self.sessions_dir, self.uploads_dir,
+                          data_dir, data_dir / 'reports', Path('database')]
+        self._storage_cache = {}
         
     def cleanup_old_sessions(self, days_to_keep: int = 7, max_sessions: int = 100):
         """清理旧会话文件"""
@@ -28,53 +177,48 @@ class CleanupManager:
                 logger.info("会话目录不存在，跳过清理")
                 return
             
-            session_files = list(self.sessions_dir.glob("*.json"))
-            logger.info(f"发现 {len(session_files)} 个会话文件")
+            session_files = list(_files(self.sessions_dir, suffix='.json'))
+            logger.info("发现 %s 个会话文件", len(session_files))
             
             if len(session_files) == 0:
                 return
             
-            # 按修改时间排序
-            session_files.sort(key=lambda f: f.stat().st_mtime, reverse=True)
+            # 并发读取修改时间（每个文件只 stat 一次），按修改时间排序
+            mtimes = _parallel_map(_mtime_or_none, session_files)
+            entries = [(f, m) for f, m in zip(session_files, mtimes) if m is not None]
+            entries.sort(key=lambda e: e[1], reverse=True)
             
             # 计算过期时间
             cutoff_time = datetime.now() - timedelta(days=days_to_keep)
             cutoff_timestamp = cutoff_time.timestamp()
             
-            deleted_count = 0
-            kept_count = 0
-            
-            for i, session_file in enumerate(session_files):
-                try:
-                    # 检查文件修改时间
-                    file_mtime = session_file.stat().st_mtime
-                    
-                    # 删除条件：超过保留天数 或 超过最大文件数
-                    should_delete = (file_mtime < cutoff_timestamp or i >= max_sessions)
-                    
-                    if should_delete:
-                        # 验证文件内容是否为有效JSON
+            # 删除条件：超过保留天数 或 超过最大文件数
+            to_delete = [f for i, (f, file_mtime) in enumerate(entries)
+                         if file_mtime < cutoff_timestamp or i >= max_sessions]
+            kept_count = len(entries) - len(to_delete)
+            
+            with _unlinker() as unlink:
+                def _unlink(session_file: os.DirEntry) -> bool:
+                    try:
+                        unlink(session_file.path)
+                        # 同时删除该会话的事件日志（<session_id>.events.jsonl）
                         try:
-                            with open(session_file, 'r', encoding='utf-8') as f:
-                                json.load(f)
-                        except:
-                            # 无效JSON文件，直接删除
+                            unlink(f"{session_file.path[:-len('.json')]}.events.jsonl")
+                        except FileNotFoundError:
                             pass
-                        
-                        session_file.unlink()
-                        deleted_count += 1
-                        logger.debug(f"删除会话文件: {session_file.name}")
-                    else:
-                        kept_count += 1
-                        
-                except Exception as e:
-                    logger.warning(f"处理会话文件失败 {session_file}: {e}")
-            
-            logger.info(f"会话清理完成: 删除 {deleted_count} 个，保留 {kept_count} 个")
+                        logger.debug("删除会话文件: %s", session_file.name)
+                        return True
+                    except Exception as e:
+                        logger.warning("处理会话文件失败 %s: %s", session_file.path, e)
+                        return False
+                
+                deleted_count = sum(_parallel_map(_unlink, to_delete))
+            
+            logger.info("会话清理完成: 删除 %s 个，保留 %s 个", deleted_count, kept_count)
             return deleted_count
             
         except Exception as e:
-            logger.error(f"清理会话文件失败: {e}")
+            logger.error("清理会话文件失败: %s", e)
             return 0
     
     def cleanup_temp_files(self):
@@ -104,23 +248,34 @@ class CleanupManager:
                             shutil.rmtree(temp_file)
                             deleted_count += 1
                     except Exception as e:
-                        logger.warning(f"删除临时文件失败 {temp_file}: {e}")
+                        logger.warning("删除临时文件失败 %s: %s", temp_file, e)
             
-            # 清理项目内的临时文件
-            project_root = Path(__file__).parent.parent
-            for pattern in ["*.tmp", "*.temp", "core.*"]:
-                for temp_file in project_root.rglob(pattern):
+            # 清理项目内的临时文件：只扫描 temp_dirs 中各目录的第一层，不再遍历整个项目树
+            # 最近1分钟内修改的 .tmp 可能是正在进行的原子写入（写临时文件后 os.replace），跳过
+            recent_cutoff = datetime.now().timestamp() - 60
+            scanned = set()
+            for temp_dir in self.temp_dirs:
+                temp_dir = os.path.abspath(temp_dir)
+                if temp_dir in scanned or not os.path.isdir(temp_dir):
+                    continue
+                scanned.add(temp_dir)
+                for temp_file in _files(temp_dir):
+                    name = temp_file.name
+                    if not (name.endswith(_TEMP_SUFFIXES) or name.startswith('core.')):
+                        continue
                     try:
-                        temp_file.unlink()
+                        if temp_file.stat(follow_symlinks=False).st_mtime > recent_cutoff:
+                            continue
+                        os.unlink(temp_file.path)
                         deleted_count += 1
                     except Exception as e:
-                        logger.warning(f"删除项目临时文件失败 {temp_file}: {e}")
+                        logger.warning("删除项目临时文件失败 %s: %s", temp_file.path, e)
             
-            logger.info(f"临时文件清理完成: 删除 {deleted_count} 个文件")
+            logger.info("临时文件清理完成: 删除 %s 个文件", deleted_count)
             return deleted_count
             
         except Exception as e:
-            logger.error(f"清理临时文件失败: {e}")
+            logger.error("清理临时文件失败: %s", e)
             return 0
     
     def cleanup_old_uploads(self, days_to_keep: int = 3):
@@ -133,58 +288,60 @@ class CleanupManager:
             cutoff_time = datetime.now() - timedelta(days=days_to_keep)
             cutoff_timestamp = cutoff_time.timestamp()
             
-            deleted_count = 0
-            upload_files = list(self.uploads_dir.rglob("*"))
-            
-            for upload_file in upload_files:
-                try:
-                    if upload_file.is_file():
-                        file_mtime = upload_file.stat().st_mtime
-                        if file_mtime < cutoff_timestamp:
-                            upload_file.unlink()
-                            deleted_count += 1
-                            logger.debug(f"删除上传文件: {upload_file.name}")
-                except Exception as e:
-                    logger.warning(f"删除上传文件失败 {upload_file}: {e}")
+            with _unlinker() as unlink:
+                def _delete_if_expired(upload_file: os.DirEntry) -> bool:
+                    try:
+                        if upload_file.stat(follow_symlinks=False).st_mtime < cutoff_timestamp:
+                            unlink(upload_file.path)
+                            logger.debug("删除上传文件: %s", upload_file.name)
+                            return True
+                    except Exception as e:
+                        logger.warning("删除上传文件失败 %s: %s", upload_file.path, e)
+                    return False
+                
+                # 边遍历边删除，不预先物化整个上传目录树
+                deleted_count = _parallel_count(_delete_if_expired, _files(self.uploads_dir, recursive=True))
             
-            logger.info(f"上传文件清理完成: 删除 {deleted_count} 个文件")
+            logger.info("上传文件清理完成: 删除 %s 个文件", deleted_count)
             return deleted_count
             
         except Exception as e:
-            logger.error(f"清理上传文件失败: {e}")
+            logger.error("清理上传文件失败: %s", e)
             return 0
     
     def get_storage_info(self) -> dict:
         """获取存储空间信息"""
         try:
+            cached = self._storage_cache
+            if cached and time.monotonic() - cached['at'] < self.STORAGE_INFO_TTL:
+                return dict(cached['info'])
+            
             project_root = Path(__file__).parent.parent
+            stats = _walk_stats([project_root, self.sessions_dir, self.uploads_dir])
             
             info = {
-                'sessions_count': len(list(self.sessions_dir.glob("*.json"))) if self.sessions_dir.exists() else 0,
-                'uploads_count': len(list(self.uploads_dir.rglob("*"))) if self.uploads_dir.exists() else 0,
-                'project_size_mb': self._get_directory_size(project_root),
-                'sessions_size_mb': self._get_directory_size(self.sessions_dir),
-                'uploads_size_mb': self._get_directory_size(self.uploads_dir)
+                'sessions_count': stats[self.sessions_dir]['json'],
+                'uploads_count': stats[self.uploads_dir]['entries'],
+                'project_size_mb': self._to_mb(stats[project_root]['bytes']),
+                'sessions_size_mb': self._to_mb(stats[self.sessions_dir]['bytes']),
+                'uploads_size_mb': self._to_mb(stats[self.uploads_dir]['bytes'])
             }
             
-            return info
+            self._storage_cache = {'at': time.monotonic(), 'info': info}
+            return dict(info)
             
         except Exception as e:
-            logger.error(f"获取存储信息失败: {e}")
+            logger.error("获取存储信息失败: %s", e)
             return {}
     
+    @staticmethod
+    def _to_mb(size: int) -> float:
+        return round(size / (1024 * 1024), 2)
+    
     def _get_directory_size(self, directory: Path) -> float:
         """获取目录大小（MB）"""
         try:
-            if not directory.exists():
-                return 0.0
-            
-            total_size = 0
-            for file_path in directory.rglob("*"):
-                if file_path.is_file():
-                    total_size += file_path.stat().st_size
-            
-            return round(total_size / (1024 * 1024), 2)
+            return self._to_mb(_walk_stats([directory])[directory]['bytes'])
         except:
             return 0.0
     
@@ -198,7 +355,7 @@ class CleanupManager:
             'uploads_deleted': self.cleanup_old_uploads()
         }
         
-        logger.info(f"系统清理完成: {results}")
+        logger.info("系统清理完成: %s", results)
         return results
 
 # 全局实例
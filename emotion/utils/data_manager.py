@@ -1,23 +1,122 @@
+import atexit
+import copy
 import json
+import logging
 import os
+import re
+import threading
+import time
+from collections import Counter
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Any, Callable, Dict, List, Optional
 from config import Config
 
+try:
+    # C 实现的 JSON 编解码，输出与 json.dumps(indent=2, ensure_ascii=False) 同格式
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    def _dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def _dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# 拼接文件路径前校验会话ID，只拒绝路径分隔符和 ..（路径穿越），其余字符保持原有行为
+_SESSION_ID_BAD_RE = re.compile(r'[/\\\x00]|\.\.')
+
+
+def _is_valid_session_id(session_id: str) -> bool:
+    return isinstance(session_id, str) and bool(session_id) and not _SESSION_ID_BAD_RE.search(session_id)
+
+
+def _check_session_id(session_id: str) -> str:
+    if not _is_valid_session_id(session_id):
+        raise ValueError(f"非法的会话ID: {session_id!r}")
+    return session_id
+
+
+# 事件时间戳：同一秒内复用已格式化的 "YYYY-MM-DDTHH:MM:SS" 前缀，只拼接微秒部分
+_clock_cache = (None, '')
+
+
+def _event_clock():
+    """返回 (本地时间 ISO 字符串, 毫秒级epoch)；ISO 格式同 datetime.isoformat()，始终带6位微秒"""
+    global _clock_cache
+    ns = time.time_ns()
+    sec, rem = divmod(ns, 1_000_000_000)
+    cached_sec, prefix = _clock_cache
+    if sec != cached_sec:
+        prefix = datetime.fromtimestamp(sec).isoformat()
+        _clock_cache = (sec, prefix)
+    return f"{prefix}.{rem // 1000:06d}", ns // 1_000_000
+
 class DataManager:
     """数据管理类，负责会话数据的存储和读取"""
     
+    # 脏会话落盘间隔、内存缓存中闲置会话的淘汰时间（秒）
+    FLUSH_INTERVAL = 2.0
+    CACHE_IDLE_TTL = 60.0
+    
+    # 追加到事件日志的数据列表，及对应的统计更新函数名
+    _EVENT_KEYS = {
+        'audio_emotions': '_update_audio_statistics',
+        'video_emotions': '_update_video_statistics',
+        'heart_rate_data': '_update_heart_rate_statistics',
+    }
+    
+    # 会话内存缓存为进程级共享：各模块各自 DataManager() 也读写同一份数据，只有一个写线程和一个 atexit 钩子
+    # 事件写入只修改内存，由后台线程定期落盘
+    # - _dirty: 需要整份重写 <session_id>.json 的会话（创建、结束、外部 save_session）
+    # - _events_dirty: 只有新事件的会话，落盘时追加到 <session_id>.events.jsonl
+    # - _flushed: 各数据列表已落盘的条数
+    _cache: Dict[str, Dict[str, Any]] = {}
+    _dirty: set = set()
+    _events_dirty: set = set()
+    _flushed: Dict[str, Dict[str, int]] = {}
+    _event_files: Dict[str, Any] = {}
+    _touched: Dict[str, float] = {}
+    _lock = threading.RLock()
+    _flush_lock = threading.Lock()
+    # save_session 唤醒写线程尽快整份落盘，调用方不等待磁盘IO
+    _wake = threading.Event()
+    _flusher: Optional[threading.Thread] = None
+    
     def __init__(self):
         # 使用绝对路径避免工作目录变化导致的问题
-        import os
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.sessions_folder = os.path.join(base_dir, Config.SESSIONS_FOLDER)
+        # 会话文件路径前缀，拼接路径时直接字符串相加
+        self._sessions_base = os.path.join(self.sessions_folder, '')
         self.ensure_directories()
+        
+        with DataManager._lock:
+            if DataManager._flusher is None:
+                DataManager._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                DataManager._flusher.start()
+                atexit.register(self.flush_all)
     
     def ensure_directories(self):
         """确保必要的目录存在"""
         os.makedirs(self.sessions_folder, exist_ok=True)
     
+    def _session_path(self, session_id: str) -> str:
+        return self._sessions_base + _check_session_id(session_id) + '.json'
+    
+    def _events_path(self, session_id: str) -> str:
+        return self._sessions_base + _check_session_id(session_id) + '.events.jsonl'
+    
     def create_session(self, session_id: str) -> Dict[str, Any]:
         """创建新的会话"""
         session_data = {
@@ -42,109 +141,326 @@ class DataManager:
         }
         
         self.save_session(session_data)
+        # 新会话立即落盘，保证其他读取文件的模块能看到
+        self.flush(session_id)
         return session_data
     
     def save_session(self, session_data: Dict[str, Any]) -> bool:
-        """保存会话数据"""
+        """保存会话数据（缓存中存放调用方字典的副本，并标记为待整份落盘）
+
+        之后调用方再修改自己的字典不会影响缓存，需要写回时再次 save_session。
+        """
         try:
-            session_file = os.path.join(self.sessions_folder, f"{session_data['session_id']}.json")
-            with open(session_file, 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, ensure_ascii=False, indent=2)
+            session_id = _check_session_id(session_data['session_id'])
+            self._store(session_id, copy.deepcopy(session_data))
             return True
         except Exception as e:
-            print(f"保存会话数据失败: {e}")
+            logger.error("保存会话数据失败: %s", e)
+            return False
+    
+    def _store(self, session_id: str, session_data: Dict[str, Any]):
+        """把缓存私有的会话字典标记为待整份落盘"""
+        with self._lock:
+            self._cache[session_id] = session_data
+            self._dirty.add(session_id)
+            self._touched[session_id] = time.monotonic()
+        self._wake.set()
+    
+    def _mark_events(self, session_id: str) -> bool:
+        """add_* 追加事件后调用：只需把新事件追加到事件日志"""
+        with self._lock:
+            self._events_dirty.add(session_id)
+            self._touched[session_id] = time.monotonic()
+        return True
+    
+    def update_session(self, session_id: str, fn: Callable[[Dict[str, Any]], Any]) -> bool:
+        """在锁内对缓存中的会话调用 fn(session_data) 原地修改并标记为待整份落盘；会话不存在时返回 False
+
+        与 load_session + save_session 不同，不会覆盖两次调用之间其他线程追加的事件。
+        """
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            if session_data is None:
+                return False
+            fn(session_data)
+            self._store(session_id, session_data)
+        return True
+    
+    def has_session(self, session_id: str) -> bool:
+        """会话是否存在（缓存或会话文件），不复制会话数据"""
+        with self._lock:
+            if session_id in self._cache:
+                return True
+        try:
+            return os.path.exists(self._session_path(session_id))
+        except ValueError:
             return False
     
     def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """加载会话数据"""
+        """加载会话数据，返回缓存的副本；调用方修改后需 save_session 写回"""
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            return copy.deepcopy(session_data) if session_data is not None else None
+    
+    def _cached_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """返回缓存中的会话字典本身（不存在时从文件加载），只在 self._lock 内使用和修改"""
+        with self._lock:
+            session_data = self._cache.get(session_id)
+            if session_data is not None:
+                self._touched[session_id] = time.monotonic()
+                return session_data
+            session_data = self._read_session_file(session_id)
+            if session_data is not None:
+                self._cache[session_id] = session_data
+                self._touched[session_id] = time.monotonic()
+                self._flushed[session_id] = {k: len(session_data.get(k) or []) for k in self._EVENT_KEYS}
+            return session_data
+    
+    def _read_session_file(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话文件，并重放事件日志中尚未合并进会话文件的事件"""
+        try:
+            session_file = self._session_path(session_id)
+            if not os.path.exists(session_file):
+                return None
+            with open(session_file, 'rb') as f:
+                session_data = _loads(f.read())
+            
+            events_file = self._events_path(session_id)
+            if os.path.exists(events_file):
+                with open(events_file, 'rb') as f:
+                    for line in f:
+                        try:
+                            event = _loads(line)
+                        except Exception:
+                            # 崩溃时可能留下写了一半的最后一行
+                            continue
+                        key = event.get('k')
+                        items = session_data.setdefault(key, [])
+                        # 只接受紧接着的下一条，已合并过的事件（重复重放）被跳过
+                        if key in self._EVENT_KEYS and event.get('i') == len(items):
+                            items.append(event['d'])
+                            getattr(self, self._EVENT_KEYS[key])(session_data, event['d'])
+            return session_data
+        except Exception as e:
+            logger.error("加载会话数据失败: %s", e)
+            return None
+    
+    def flush(self, session_id: str, sync: bool = False) -> bool:
+        """
+        把缓存中的会话写回磁盘：整份重写用临时文件 + os.replace，新事件只追加到事件日志
+        
+        常规落盘不 fsync（os.replace 已保证文件级原子）；sync=True 时整份重写前 fsync，用于会话结束
+        """
+        with self._flush_lock:
+            with self._lock:
+                full = session_id in self._dirty
+                if not full and session_id not in self._events_dirty:
+                    return True
+                session_data = self._cache.get(session_id)
+                self._dirty.discard(session_id)
+                self._events_dirty.discard(session_id)
+                if session_data is None:
+                    return True
+                try:
+                    counts = {k: len(session_data.get(k) or []) for k in self._EVENT_KEYS}
+                    if full:
+                        payload = _dumps(session_data)
+                    else:
+                        flushed = self._flushed.get(session_id, {})
+                        payload = b''.join(
+                            _dumps_line({'k': key, 'i': i, 'd': session_data[key][i]})
+                            for key, n in counts.items()
+                            for i in range(flushed.get(key, 0), n)
+                        )
+                except Exception as e:
+                    self._dirty.add(session_id)
+                    logger.error("保存会话数据失败: %s", e)
+                    return False
+            
+            try:
+                if full:
+                    session_file = self._session_path(session_id)
+                    tmp_file = f"{session_file}.tmp"
+                    with open(tmp_file, 'wb') as f:
+                        f.write(payload)
+                        if sync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    os.replace(tmp_file, session_file)
+                    # 会话文件已包含全部事件，事件日志作废
+                    self._close_events(session_id, remove=True)
+                else:
+                    f = self._event_files.get(session_id)
+                    # 事件日志被整份重写或外部清理删除后，旧句柄指向已删除的文件，需要重新打开
+                    if f is not None and os.fstat(f.fileno()).st_nlink == 0:
+                        self._close_events(session_id)
+                        f = None
+                    if f is None:
+                        f = self._event_files[session_id] = open(self._events_path(session_id), 'ab')
+                    f.write(payload)
+                    f.flush()
+                self._flushed[session_id] = counts
+                return True
+            except Exception as e:
+                with self._lock:
+                    self._dirty.add(session_id)
+                logger.error("保存会话数据失败: %s", e)
+                return False
+    
+    def _close_events(self, session_id: str, remove: bool = False):
+        f = self._event_files.pop(session_id, None)
+        if f is not None:
+            f.close()
+        if remove:
+            try:
+                os.remove(self._events_path(session_id))
+            except FileNotFoundError:
+                pass
+    
+    def flush_all(self):
+        """落盘所有待写会话"""
+        with self._lock:
+            dirty = list(self._dirty | self._events_dirty)
+        for session_id in dirty:
+            self.flush(session_id)
+    
+    def _evict(self, session_id: str):
+        with self._flush_lock:
+            with self._lock:
+                if session_id in self._dirty or session_id in self._events_dirty:
+                    return
+                self._cache.pop(session_id, None)
+                self._touched.pop(session_id, None)
+                self._flushed.pop(session_id, None)
+            self._close_events(session_id)
+    
+    def _flush_loop(self):
+        """后台落盘（定期或被 save_session 唤醒），并淘汰长时间没有访问的会话"""
+        while True:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush_all()
+                cutoff = time.monotonic() - self.CACHE_IDLE_TTL
+                with self._lock:
+                    idle = [sid for sid, ts in self._touched.items() if ts < cutoff]
+                for session_id in idle:
+                    self._evict(session_id)
+            except Exception as e:
+                logger.error("会话落盘失败: %s", e)
+    
+    def open_session_file(self, session_id: str):
+        """以二进制方式打开会话文件（用于不经解析的流式复制），不存在时返回None"""
+        if not _is_valid_session_id(session_id):
+            return None
+        # 先把事件日志合并进会话文件，保证文件内容完整
+        with self._lock:
+            if session_id in self._events_dirty or os.path.exists(self._events_path(session_id)):
+                if self._cached_session(session_id) is not None:
+                    self._dirty.add(session_id)
+        self.flush(session_id)
         try:
-            session_file = os.path.join(self.sessions_folder, f"{session_id}.json")
+            session_file = self._session_path(session_id)
             if os.path.exists(session_file):
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return open(session_file, 'rb')
             return None
         except Exception as e:
-            print(f"加载会话数据失败: {e}")
+            logger.error("打开会话文件失败: %s", e)
             return None
     
     def add_audio_emotion(self, session_id: str, emotion_data: Dict[str, Any]) -> bool:
         """添加语音情绪分析结果"""
-        session_data = self.load_session(session_id)
-        if not session_data:
-            return False
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            if not session_data:
+                return False
         
-        # 只保存需要的字段
-        filtered_data = {
-            'emotions': emotion_data.get('emotions', {}),
-            'dominant_emotion': emotion_data.get('dominant_emotion'),
-            'timestamp': datetime.now().isoformat()
-        }
+            # 只保存需要的字段；_ts_ms 为毫秒级epoch，报告匹配时直接做整数比较
+            timestamp, ts_ms = _event_clock()
+            filtered_data = {
+                'emotions': emotion_data.get('emotions', {}),
+                'dominant_emotion': emotion_data.get('dominant_emotion'),
+                'timestamp': timestamp,
+                '_ts_ms': ts_ms
+            }
         
-        # 添加到音频情绪列表
-        session_data['audio_emotions'].append(filtered_data)
+            # 添加到音频情绪列表
+            session_data['audio_emotions'].append(filtered_data)
         
-        # 更新统计信息
-        self._update_audio_statistics(session_data, filtered_data)
+            # 更新统计信息
+            self._update_audio_statistics(session_data, filtered_data)
         
-        return self.save_session(session_data)
+            return self._mark_events(session_id)
     
     def add_video_emotion(self, session_id: str, emotion_data: Dict[str, Any]) -> bool:
         """添加视频情绪分析结果"""
-        session_data = self.load_session(session_id)
-        if not session_data:
-            return False
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            if not session_data:
+                return False
 
-        # 只保存需要的字段
-        filtered_data = {
-            'emotions': emotion_data.get('emotions', {}),
-            'dominant_emotion': emotion_data.get('dominant_emotion'),
-            'timestamp': datetime.now().isoformat()
-        }
+            # 只保存需要的字段；_ts_ms 为毫秒级epoch，报告匹配时直接做整数比较
+            timestamp, ts_ms = _event_clock()
+            filtered_data = {
+                'emotions': emotion_data.get('emotions', {}),
+                'dominant_emotion': emotion_data.get('dominant_emotion'),
+                'timestamp': timestamp,
+                '_ts_ms': ts_ms
+            }
 
-        # 添加到视频情绪列表
-        session_data['video_emotions'].append(filtered_data)
+            # 添加到视频情绪列表
+            session_data['video_emotions'].append(filtered_data)
 
-        # 更新统计信息
-        self._update_video_statistics(session_data, filtered_data)
+            # 更新统计信息
+            self._update_video_statistics(session_data, filtered_data)
 
-        return self.save_session(session_data)
+            return self._mark_events(session_id)
 
     def add_heart_rate_data(self, session_id: str, heart_rate_data: Dict[str, Any]) -> bool:
         """添加心率检测结果"""
-        session_data = self.load_session(session_id)
-        if not session_data:
-            return False
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            if not session_data:
+                return False
 
-        # 只保存需要的字段
-        filtered_data = {
-            'heart_rate': heart_rate_data.get('heart_rate'),
-            'signal_length': heart_rate_data.get('signal_length', 0),
-            'timestamp': datetime.now().isoformat()
-        }
+            # 只保存需要的字段；_ts_ms 为毫秒级epoch，报告匹配时直接做整数比较
+            timestamp, ts_ms = _event_clock()
+            filtered_data = {
+                'heart_rate': heart_rate_data.get('heart_rate'),
+                'signal_length': heart_rate_data.get('signal_length', 0),
+                'timestamp': timestamp,
+                '_ts_ms': ts_ms
+            }
 
-        # 添加到心率数据列表
-        session_data['heart_rate_data'].append(filtered_data)
+            # 添加到心率数据列表
+            session_data['heart_rate_data'].append(filtered_data)
 
-        # 更新统计信息
-        self._update_heart_rate_statistics(session_data, filtered_data)
+            # 更新统计信息
+            self._update_heart_rate_statistics(session_data, filtered_data)
 
-        return self.save_session(session_data)
+            return self._mark_events(session_id)
 
     def end_session(self, session_id: str) -> bool:
         """结束会话"""
-        session_data = self.load_session(session_id)
-        if not session_data:
-            return False
-        
-        session_data['end_time'] = datetime.now().isoformat()
-        # 与契约统一，标记为 stopped 以允许后续题目分析
-        session_data['status'] = 'stopped'
-        
-        # 计算最终统计信息
-        self._calculate_final_statistics(session_data)
+        # 在锁内完成修改并取快照，避免与并发的 add_* 交错；落盘在锁外进行（flush 先取 _flush_lock）
+        with self._lock:
+            session_data = self._cached_session(session_id)
+            if not session_data:
+                return False
+            
+            end_time = datetime.now()
+            session_data['end_time'] = end_time.isoformat()
+            # 与契约统一，标记为 stopped 以允许后续题目分析
+            session_data['status'] = 'stopped'
+            
+            # 计算最终统计信息
+            self._calculate_final_statistics(session_data, end_time)
+            
+            self._store(session_id, session_data)
+            session_data = copy.deepcopy(session_data)
 
-        # 保存会话
-        saved = self.save_session(session_data)
+        # 结束时立即落盘
+        saved = self.flush(session_id, sync=True)
 
         # 尝试触发 Finalize 回调（通过契约回调服务）
         # 注意：这里作为兜底逻辑，仅在本地/简化接口 end_session 调用时生效；
@@ -172,34 +488,52 @@ class DataManager:
         
         for filename in os.listdir(self.sessions_folder):
             if filename.endswith('.json'):
-                session_data = self.load_session(filename[:-5])  # 移除.json后缀
-                if session_data:
-                    # 只返回摘要信息
-                    summary = {
-                        'session_id': session_data['session_id'],
-                        'start_time': session_data['start_time'],
-                        'end_time': session_data.get('end_time'),
-                        'status': session_data['status'],
-                        'audio_emotion_count': len(session_data.get('audio_emotions', [])),
-                        'video_emotion_count': len(session_data.get('video_emotions', [])),
-                        'statistics': session_data.get('statistics', {})
-                    }
+                session_id = filename[:-5]  # 移除.json后缀
+                # 不把所有历史会话都读进缓存；缓存中的会话在锁内生成摘要（统计信息复制一份）
+                with self._lock:
+                    session_data = self._cache.get(session_id)
+                    summary = self._summarize(session_data) if session_data else None
+                if summary is None:
+                    session_data = self._read_session_file(session_id)
+                    summary = self._summarize(session_data) if session_data else None
+                if summary is not None:
                     sessions.append(summary)
         
         # 按开始时间排序
         sessions.sort(key=lambda x: x['start_time'], reverse=True)
         return sessions
     
+    @staticmethod
+    def _summarize(session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """会话摘要信息"""
+        return {
+            'session_id': session_data['session_id'],
+            'start_time': session_data['start_time'],
+            'end_time': session_data.get('end_time'),
+            'status': session_data['status'],
+            'audio_emotion_count': len(session_data.get('audio_emotions', [])),
+            'video_emotion_count': len(session_data.get('video_emotions', [])),
+            'statistics': copy.deepcopy(session_data.get('statistics', {}))
+        }
+    
     def delete_session(self, session_id: str) -> bool:
         """删除会话"""
         try:
-            session_file = os.path.join(self.sessions_folder, f"{session_id}.json")
+            with self._flush_lock:
+                with self._lock:
+                    self._cache.pop(session_id, None)
+                    self._dirty.discard(session_id)
+                    self._events_dirty.discard(session_id)
+                    self._touched.pop(session_id, None)
+                    self._flushed.pop(session_id, None)
+                self._close_events(session_id, remove=True)
+            session_file = self._session_path(session_id)
             if os.path.exists(session_file):
                 os.remove(session_file)
                 return True
             return False
         except Exception as e:
-            print(f"删除会话失败: {e}")
+            logger.error("删除会话失败: %s", e)
             return False
     
     def _update_audio_statistics(self, session_data: Dict[str, Any], emotion_data: Dict[str, Any]):
@@ -207,18 +541,26 @@ class DataManager:
         stats = session_data['statistics']
         stats['total_audio_analyses'] += 1
         
-        # 更新主导情绪
+        # 更新主导情绪与情绪分布
         if 'dominant_emotion' in emotion_data:
-            stats['dominant_audio_emotion'] = emotion_data['dominant_emotion']
+            dominant = emotion_data['dominant_emotion']
+            stats['dominant_audio_emotion'] = dominant
+            if dominant:
+                dist = stats.setdefault('audio_emotion_distribution', {})
+                dist[dominant] = dist.get(dominant, 0) + 1
     
     def _update_video_statistics(self, session_data: Dict[str, Any], emotion_data: Dict[str, Any]):
         """更新视频统计信息"""
         stats = session_data['statistics']
         stats['total_video_analyses'] += 1
 
-        # 更新主导情绪
+        # 更新主导情绪与情绪分布
         if 'dominant_emotion' in emotion_data:
-            stats['dominant_video_emotion'] = emotion_data['dominant_emotion']
+            dominant = emotion_data['dominant_emotion']
+            stats['dominant_video_emotion'] = dominant
+            if dominant:
+                dist = stats.setdefault('video_emotion_distribution', {})
+                dist[dominant] = dist.get(dominant, 0) + 1
 
     def _update_heart_rate_statistics(self, session_data: Dict[str, Any], heart_rate_data: Dict[str, Any]):
         """更新心率统计信息 - 简化版本"""
@@ -235,17 +577,17 @@ class DataManager:
             new_avg = (current_avg * (total_count - 1) + heart_rate) / total_count
             stats['average_heart_rate'] = new_avg
 
-            # 更新心率范围
-            if stats['heart_rate_range']['min'] == 0 or heart_rate < stats['heart_rate_range']['min']:
+            # 更新心率范围（首条有效读数直接作为最小值，不依赖 0 作哨兵）
+            if total_count == 1 or heart_rate < stats['heart_rate_range']['min']:
                 stats['heart_rate_range']['min'] = heart_rate
             if heart_rate > stats['heart_rate_range']['max']:
                 stats['heart_rate_range']['max'] = heart_rate
 
-    def _calculate_final_statistics(self, session_data: Dict[str, Any]):
+    def _calculate_final_statistics(self, session_data: Dict[str, Any], end_time: Optional[datetime] = None):
         """计算最终统计信息"""
         # 防御性检查：确保statistics字段存在
         if 'statistics' not in session_data:
-            print(f"⚠️ statistics字段缺失，为会话 {session_data.get('session_id', 'unknown')} 初始化默认值")
+            logger.warning("statistics字段缺失，为会话 %s 初始化默认值", session_data.get('session_id', 'unknown'))
             session_data['statistics'] = {
                 'total_audio_analyses': 0,
                 'total_video_analyses': 0,
@@ -259,30 +601,18 @@ class DataManager:
                 'duration_seconds': 0.0
             }
         
-        audio_emotions = session_data.get('audio_emotions', [])
-        video_emotions = session_data.get('video_emotions', [])
-
-        # 计算情绪分布
-        audio_emotion_counts = {}
-        video_emotion_counts = {}
-
-        for emotion in audio_emotions:
-            dominant = emotion.get('dominant_emotion')
-            if dominant:
-                audio_emotion_counts[dominant] = audio_emotion_counts.get(dominant, 0) + 1
-
-        for emotion in video_emotions:
-            dominant = emotion.get('dominant_emotion')
-            if dominant:
-                video_emotion_counts[dominant] = video_emotion_counts.get(dominant, 0) + 1
-
-        # 安全地添加到统计信息
-        session_data['statistics']['audio_emotion_distribution'] = audio_emotion_counts
-        session_data['statistics']['video_emotion_distribution'] = video_emotion_counts
+        # 情绪分布已在每次添加事件时增量维护；只为旧版本写入（结束时才统计分布）的会话补算一次
+        stats = session_data['statistics']
+        for key, dist_key in (('audio_emotions', 'audio_emotion_distribution'),
+                              ('video_emotions', 'video_emotion_distribution')):
+            items = session_data.get(key, [])
+            if items and not stats.get(dist_key):
+                stats[dist_key] = dict(Counter(d for d in (e.get('dominant_emotion') for e in items) if d))
 
-        # 计算会话持续时间
+        # 计算会话持续时间（end_session 直接传入结束时间，不再解析刚生成的字符串）
         if session_data.get('end_time') and session_data.get('start_time'):
             start_time = datetime.fromisoformat(session_data['start_time'])
-            end_time = datetime.fromisoformat(session_data['end_time'])
+            if end_time is None:
+                end_time = datetime.fromisoformat(session_data['end_time'])
             duration = (end_time - start_time).total_seconds()
             session_data['statistics']['duration_seconds'] = duration
@@ -3,8 +3,13 @@
 提供统一的错误处理、日志记录和用户通知功能
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
+import re
 import traceback
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Any, Optional
 from enum import Enum
@@ -16,22 +21,83 @@ class ErrorLevel(Enum):
     ERROR = "error"
     CRITICAL = "critical"
 
+# 用户提示规则：(上下文前缀, [(关键字, 提示)], 该上下文的默认提示)，按顺序匹配
+_CONTEXT_MSG_RULES = (
+    # 视频处理相关错误
+    ('video', (
+        (('decode', 'format'), "视频格式不支持或文件损坏，请尝试使用MP4格式"),
+        (('memory', 'size'), "视频文件过大，请使用较小的文件或调整分辨率"),
+        (('deepface', 'model'), "面部情绪分析暂时不可用，请稍后重试"),
+    ), "视频处理遇到问题，请检查文件格式或重新上传"),
+    # 音频处理相关错误
+    ('audio', (
+        (('decode', 'format'), "音频格式不支持，请检查音频设备或文件格式"),
+        (('emotion2vec', 'model'), "语音情绪分析暂时不可用，请稍后重试"),
+        (('microphone', 'device'), "麦克风访问失败，请检查设备权限"),
+    ), "音频处理遇到问题，请检查设备或重新启动"),
+    # 心率检测相关错误
+    ('heart_rate', (
+        (('face', 'detection'), "无法检测到人脸，请确保光线充足且面部清晰可见"),
+        (('signal', 'quality'), "心率信号质量不佳，请保持静止并确保良好光照"),
+    ), "心率检测暂时不可用，请稍后重试"),
+)
+
+# 其他上下文：网络和连接错误、权限相关错误
+_GENERIC_MSG_RULES = (
+    (('connection', 'network'), "网络连接不稳定，请检查网络连接"),
+    (('permission', 'access'), "权限不足，请允许浏览器访问摄像头和麦克风"),
+)
+
+def _compile_rules(rules):
+    """把一组规则的关键字编译成单个正则，命名分组 r<序号> 对应规则序号；返回 (正则, 提示列表)"""
+    pattern = re.compile('|'.join(
+        f"(?P<r{i}>{'|'.join(map(re.escape, keywords))})" for i, (keywords, _) in enumerate(rules)
+    ))
+    return pattern, tuple(message for _, message in rules)
+
+_CONTEXT_MSG_PATTERNS = tuple(
+    (prefix, *_compile_rules(rules), fallback) for prefix, rules, fallback in _CONTEXT_MSG_RULES
+)
+_GENERIC_MSG_PATTERN = _compile_rules(_GENERIC_MSG_RULES)
+
+class _BoundedDict(OrderedDict):
+    """容量有限的字典：写入的键移到末尾，超出容量时淘汰最久未写入的键"""
+    
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
 class ErrorHandler:
     """统一错误处理器"""
     
+    # 错误统计最多保留的 error_id 数，长时间运行时避免无限增长
+    MAX_TRACKED_ERRORS = 1024
+    
     def __init__(self):
-        self.error_counts = {}
-        self.last_errors = {}
+        self.error_counts = _BoundedDict(self.MAX_TRACKED_ERRORS)
+        self.last_errors = _BoundedDict(self.MAX_TRACKED_ERRORS)
         
-        # 设置日志格式
+        # 设置日志格式：调用线程只把记录放入队列，由 QueueListener 线程格式化后写文件/终端，
+        # 高并发时日志IO不会阻塞 socketio 的处理线程
+        log_queue = queue.SimpleQueue()
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue,
+            logging.FileHandler('app_errors.log', encoding='utf-8'),
+            logging.StreamHandler()
+        )
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('app_errors.log', encoding='utf-8'),
-                logging.StreamHandler()
-            ]
+            handlers=[logging.handlers.QueueHandler(log_queue)]
         )
+        self._log_listener.start()
+        atexit.register(self._log_listener.stop)
         self.logger = logging.getLogger(__name__)
     
     def handle_error(self, error: Exception, context: str, session_id: str = None, 
@@ -78,51 +144,23 @@ class ErrorHandler:
     
     def _generate_user_message(self, error: Exception, context: str) -> str:
         """生成用户友好的错误消息"""
-        error_type = type(error).__name__
         error_msg = str(error).lower()
         
-        # 视频处理相关错误
-        if context.startswith('video'):
-            if 'decode' in error_msg or 'format' in error_msg:
-                return "视频格式不支持或文件损坏，请尝试使用MP4格式"
-            elif 'memory' in error_msg or 'size' in error_msg:
-                return "视频文件过大，请使用较小的文件或调整分辨率"
-            elif 'deepface' in error_msg or 'model' in error_msg:
-                return "面部情绪分析暂时不可用，请稍后重试"
-            else:
-                return "视频处理遇到问题，请检查文件格式或重新上传"
-        
-        # 音频处理相关错误
-        elif context.startswith('audio'):
-            if 'decode' in error_msg or 'format' in error_msg:
-                return "音频格式不支持，请检查音频设备或文件格式"
-            elif 'emotion2vec' in error_msg or 'model' in error_msg:
-                return "语音情绪分析暂时不可用，请稍后重试"
-            elif 'microphone' in error_msg or 'device' in error_msg:
-                return "麦克风访问失败，请检查设备权限"
-            else:
-                return "音频处理遇到问题，请检查设备或重新启动"
-        
-        # 心率检测相关错误
-        elif context.startswith('heart_rate'):
-            if 'face' in error_msg or 'detection' in error_msg:
-                return "无法检测到人脸，请确保光线充足且面部清晰可见"
-            elif 'signal' in error_msg or 'quality' in error_msg:
-                return "心率信号质量不佳，请保持静止并确保良好光照"
-            else:
-                return "心率检测暂时不可用，请稍后重试"
-        
-        # 网络和连接错误
-        elif 'connection' in error_msg or 'network' in error_msg:
-            return "网络连接不稳定，请检查网络连接"
+        for prefix, pattern, messages, fallback in _CONTEXT_MSG_PATTERNS:
+            if context.startswith(prefix):
+                break
+        else:
+            (pattern, messages), fallback = _GENERIC_MSG_PATTERN, None
         
-        # 权限相关错误
-        elif 'permission' in error_msg or 'access' in error_msg:
-            return "权限不足，请允许浏览器访问摄像头和麦克风"
+        # 一次扫描找出所有命中的规则，取序号最小（最靠前）的一条
+        hits = [int(m.lastgroup[1:]) for m in pattern.finditer(error_msg)]
+        if hits:
+            return messages[min(hits)]
         
+        if fallback:
+            return fallback
         # 默认错误消息
-        else:
-            return f"系统遇到问题，请稍后重试（错误类型：{error_type}）"
+        return f"系统遇到问题，请稍后重试（错误类型：{type(error).__name__}）"
     
     def get_error_statistics(self) -> Dict[str, Any]:
         """获取错误统计信息"""
@@ -5,6 +5,7 @@ GPU管理器
 
 import torch
 import logging
+import threading
 from typing import Dict, Any, Optional
 from config import Config
 
@@ -13,19 +14,38 @@ logger = logging.getLogger(__name__)
 class GPUManager:
     """GPU管理器"""
     
+    # 批处理大小分档的可用显存阈值（字节，整数比较）
+    _4GB = 4 * 1024**3
+    _2GB = 2 * 1024**3
+    # 显存溢出后连续成功多少次解除批大小上限
+    OOM_RECOVERY_CALLS = 32
+    
     def __init__(self):
         self.gpu_available = torch.cuda.is_available()
         self.device_count = torch.cuda.device_count() if self.gpu_available else 0
         self.current_device = 0 if self.gpu_available else None
         self.memory_threshold_gb = 1.0  # 最小GPU内存要求 (GB)
+        self._threshold_bytes = int(self.memory_threshold_gb * 1024**3)
+        # 显存使用率告警阈值，以 百分比*100 的整数保存（9000 即 90.00%），比较时不涉及浮点
+        self._threshold_pct_x100 = self._pct_x100(Config.GPU_MEMORY_ALERT_PERCENT)
+        
+        # 设备属性在进程生命周期内不变，初始化时查询一次，避免每次状态查询都调用驱动接口；
+        # 按 device_id 下标存放的并列数组（SoA）
+        props = [torch.cuda.get_device_properties(i) for i in range(self.device_count)]
+        self._names = [p.name for p in props]
+        self._total_mem = [p.total_memory for p in props]
+        
+        # 最近一次给出的批大小；显存溢出后的批大小上限，及其后连续成功的调用数
+        self._last_batch_size = None
+        self._batch_cap = None
+        self._oom_ok_calls = 0
         
         if self.gpu_available:
             logger.info(f"GPU管理器初始化完成:")
             logger.info(f"  GPU可用: {self.gpu_available}")
             logger.info(f"  GPU数量: {self.device_count}")
-            for i in range(self.device_count):
-                gpu_name = torch.cuda.get_device_name(i)
-                gpu_memory = torch.cuda.get_device_properties(i).total_memory / 1024**3
+            for i, gpu_name in enumerate(self._names):
+                gpu_memory = self._total_mem[i] / 1024**3
                 logger.info(f"  GPU {i}: {gpu_name} ({gpu_memory:.1f} GB)")
         else:
             logger.info("未检测到可用的GPU设备，将使用CPU模式")
@@ -53,18 +73,26 @@ class GPUManager:
         
         device_id = device_id or self.current_device
         try:
-            gpu_props = torch.cuda.get_device_properties(device_id)
-            total_memory = gpu_props.total_memory
-            allocated_memory = torch.cuda.memory_allocated(device_id)
-            available_memory = total_memory - allocated_memory
-            
-            available_gb = available_memory / 1024**3
-            return available_gb >= self.memory_threshold_gb
+            return self._available_bytes(device_id) >= self._threshold_bytes
             
         except Exception as e:
             logger.warning(f"检查GPU内存失败: {e}")
             return False
     
+    @staticmethod
+    def _device_available_bytes(device_id: int) -> int:
+        """
+        可用显存字节数 = 驱动报告的空闲显存 + 本进程缓存中可复用的部分（已保留 - 已分配）
+        
+        驱动空闲值已扣除同一GPU上其他进程占用的显存，比 总显存 - 已分配 更准确
+        """
+        free, _ = torch.cuda.mem_get_info(device_id)
+        return free + torch.cuda.memory_reserved(device_id) - torch.cuda.memory_allocated(device_id)
+    
+    def _available_bytes(self, device_id: int = None) -> int:
+        """当前设备的可用显存字节数，供高频调用的辅助方法使用，不构造状态字典"""
+        return self._device_available_bytes(device_id or self.current_device)
+    
     def get_gpu_status(self, device_id: int = None) -> Dict[str, Any]:
         """获取GPU状态信息"""
         status = {
@@ -79,21 +107,21 @@ class GPUManager:
         device_id = device_id or self.current_device
         
         try:
-            gpu_props = torch.cuda.get_device_properties(device_id)
-            total_memory = gpu_props.total_memory
+            total_memory = self._total_mem[device_id]
             allocated_memory = torch.cuda.memory_allocated(device_id)
             cached_memory = torch.cuda.memory_reserved(device_id)
-            available_memory = total_memory - allocated_memory
+            free_memory, _ = torch.cuda.mem_get_info(device_id)
+            available_memory = free_memory + cached_memory - allocated_memory
             
             status.update({
                 'device_id': device_id,
-                'device_name': gpu_props.name,
+                'device_name': self._names[device_id],
                 'total_memory_gb': total_memory / 1024**3,
                 'allocated_memory_gb': allocated_memory / 1024**3,
                 'cached_memory_gb': cached_memory / 1024**3,
                 'available_memory_gb': available_memory / 1024**3,
                 'memory_usage_percent': (allocated_memory / total_memory) * 100,
-                'sufficient_memory': available_memory / 1024**3 >= self.memory_threshold_gb
+                'sufficient_memory': available_memory >= self._threshold_bytes
             })
             
         except Exception as e:
@@ -101,10 +129,10 @@ class GPUManager:
             
         return status
     
-    def optimize_memory(self, device_id: int = None):
-        """优化GPU内存使用"""
+    def optimize_memory(self, device_id: int = None, log_level: int = logging.INFO):
+        """优化GPU内存使用（高频调用方传 log_level=logging.DEBUG）"""
         if not self.gpu_available:
-            logger.info("未使用GPU，无需优化内存")
+            logger.log(log_level, "未使用GPU，无需优化内存")
             return True
         
         device_id = device_id or self.current_device
@@ -116,11 +144,11 @@ class GPUManager:
             # 获取优化后的内存状态
             status = self.get_gpu_status(device_id)
             
-            logger.info(f"GPU {device_id} 内存优化完成:")
+            logger.log(log_level, f"GPU {device_id} 内存优化完成:")
             if 'allocated_memory_gb' in status:
-                logger.info(f"  已分配: {status['allocated_memory_gb']:.2f} GB")
-                logger.info(f"  已缓存: {status['cached_memory_gb']:.2f} GB")
-                logger.info(f"  可用: {status['available_memory_gb']:.2f} GB")
+                logger.log(log_level, f"  已分配: {status['allocated_memory_gb']:.2f} GB")
+                logger.log(log_level, f"  已缓存: {status['cached_memory_gb']:.2f} GB")
+                logger.log(log_level, f"  可用: {status['available_memory_gb']:.2f} GB")
             
             return True
             
@@ -134,11 +162,13 @@ class GPUManager:
             return
         
         try:
-            # 启用CUDNN优化
+            # 启用CUDNN优化：benchmark 只在输入尺寸固定时有益，尺寸多变时由 disable_cudnn_benchmark 关闭；
+            # 需要可复现结果时设置 Config.CUDNN_DETERMINISTIC，以速度换确定性
             if hasattr(torch.backends, 'cudnn'):
-                torch.backends.cudnn.benchmark = True
-                torch.backends.cudnn.deterministic = False
-                logger.info("✓ CUDNN优化已启用")
+                deterministic = Config.CUDNN_DETERMINISTIC
+                torch.backends.cudnn.benchmark = not deterministic
+                torch.backends.cudnn.deterministic = deterministic
+                logger.info(f"✓ CUDNN优化已启用 (benchmark={not deterministic}, deterministic={deterministic})")
             
             # 设置CUDA可见设备
             import os
@@ -149,16 +179,27 @@ class GPUManager:
         except Exception as e:
             logger.warning(f"GPU优化配置失败: {e}")
     
-    def monitor_memory_usage(self, threshold_percent: float = 90.0) -> bool:
-        """监控GPU内存使用，如果超过阈值则发出警告"""
+    def disable_cudnn_benchmark(self, reason: str = ""):
+        """关闭 cudnn.benchmark（输入尺寸多变时，每种新尺寸都会重新自动调优，反而更慢）"""
+        if hasattr(torch.backends, 'cudnn') and torch.backends.cudnn.benchmark:
+            torch.backends.cudnn.benchmark = False
+            logger.info(f"已关闭 cudnn.benchmark: {reason}")
+    
+    def monitor_memory_usage(self, threshold_percent: float = None) -> bool:
+        """监控GPU内存使用，如果超过阈值（默认取 Config.GPU_MEMORY_ALERT_PERCENT 或 set_memory_threshold_percent 的设置）则发出警告"""
         if not self.gpu_available:
             return True
         
         try:
-            status = self.get_gpu_status()
-            usage_percent = status.get('memory_usage_percent', 0)
+            threshold_x100 = (self._threshold_pct_x100 if threshold_percent is None
+                              else int(round(threshold_percent * 100)))
+            device_id = self.current_device
+            total_memory = self._total_mem[device_id]
+            allocated_memory = torch.cuda.memory_allocated(device_id)
             
-            if usage_percent > threshold_percent:
+            # 整数交叉相乘比较，只有超过阈值时才计算百分比用于日志
+            if allocated_memory * 10000 > threshold_x100 * total_memory:
+                usage_percent = allocated_memory / total_memory * 100
                 logger.warning(f"GPU内存使用率过高: {usage_percent:.1f}%")
                 logger.warning("建议优化内存使用或降低批处理大小")
                 return False
@@ -169,29 +210,85 @@ class GPUManager:
             logger.error(f"GPU内存监控失败: {e}")
             return False
     
+    def record_oom(self):
+        """推理发生显存溢出：之后的批大小上限减半"""
+        last = self._batch_cap or self._last_batch_size
+        if last:
+            self._batch_cap = max(1, last // 2)
+            logger.warning(f"GPU显存溢出，批处理大小上限降为: {self._batch_cap}")
+    
+    @staticmethod
+    def _is_oom(error: Exception) -> bool:
+        oom_error = getattr(torch.cuda, 'OutOfMemoryError', None)
+        if oom_error is not None and isinstance(error, oom_error):
+            return True
+        return isinstance(error, RuntimeError) and 'out of memory' in str(error).lower()
+    
+    def run_with_oom_retry(self, fn, batch: list) -> list:
+        """
+        执行 fn(batch)（返回与 batch 一一对应的结果列表），显存溢出时清空缓存并把批次对半拆开重试
+        
+        单个样本仍然溢出时抛出原异常
+        """
+        try:
+            results = fn(batch)
+        except Exception as e:
+            if not self._is_oom(e):
+                raise
+            if self.gpu_available:
+                torch.cuda.empty_cache()
+            self.record_oom()
+            self._oom_ok_calls = 0
+            if len(batch) <= 1:
+                raise
+            half = len(batch) // 2
+            logger.warning(f"GPU显存溢出，批次 {len(batch)} 拆分为 {half} + {len(batch) - half} 重试")
+            return self.run_with_oom_retry(fn, batch[:half]) + self.run_with_oom_retry(fn, batch[half:])
+        
+        if self._batch_cap is not None:
+            self._oom_ok_calls += 1
+            if self._oom_ok_calls >= self.OOM_RECOVERY_CALLS:
+                self._oom_ok_calls = 0
+                self._batch_cap = None
+        return results
+    
     def get_optimal_batch_size(self, base_batch_size: int = 8) -> int:
         """根据GPU内存动态调整批处理大小"""
         if not self.gpu_available:
             return 1  # CPU模式使用单个样本
         
         try:
-            status = self.get_gpu_status()
-            available_gb = status.get('available_memory_gb', 0)
+            available = self._available_bytes()
             
-            if available_gb >= 4.0:
-                return base_batch_size
-            elif available_gb >= 2.0:
-                return max(1, base_batch_size // 2)
+            if available >= self._4GB:
+                batch_size = base_batch_size
+            elif available >= self._2GB:
+                batch_size = max(1, base_batch_size // 2)
             else:
-                return 1
+                batch_size = 1
+            
+            if self._batch_cap is not None:
+                batch_size = min(batch_size, self._batch_cap)
+            self._last_batch_size = batch_size
+            return batch_size
                 
         except Exception as e:
             logger.warning(f"获取最优批处理大小失败: {e}")
             return 1
     
+    @staticmethod
+    def _pct_x100(threshold_percent: float) -> int:
+        return int(round(max(0.0, min(100.0, threshold_percent)) * 100))
+    
+    def set_memory_threshold_percent(self, threshold_percent: float):
+        """设置GPU内存使用率告警阈值（百分比，默认取 Config.GPU_MEMORY_ALERT_PERCENT）"""
+        self._threshold_pct_x100 = self._pct_x100(threshold_percent)
+        logger.info(f"GPU内存使用率告警阈值设置为: {self._threshold_pct_x100 / 100:.2f}%")
+    
     def set_memory_threshold(self, threshold_gb: float):
         """设置GPU内存阈值"""
         self.memory_threshold_gb = max(0.5, threshold_gb)
+        self._threshold_bytes = int(self.memory_threshold_gb * 1024**3)
         logger.info(f"GPU内存阈值设置为: {self.memory_threshold_gb:.1f} GB")
     
     def create_device_context(self, device_id: int = None):
@@ -202,5 +299,16 @@ class GPUManager:
         device_id = device_id or self.current_device
         return torch.cuda.device(device_id)
 
-# 全局GPU管理器实例
-gpu_manager = GPUManager()
\ No newline at end of file
+# 全局GPU管理器实例：首次使用时才创建，导入本模块不会初始化CUDA（也允许 fork 出的子进程再初始化）
+_gpu_manager = None
+_gpu_manager_lock = threading.Lock()
+
+
+def get_gpu_manager() -> GPUManager:
+    """获取全局GPU管理器（延迟创建）"""
+    global _gpu_manager
+    if _gpu_manager is None:
+        with _gpu_manager_lock:
+            if _gpu_manager is None:
+                _gpu_manager = GPUManager()
+    return _gpu_manager
\ No newline at end of file
@@ -1,181 +1,361 @@
-import base64
+import atexit
+import binascii
 import io
+import itertools
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 from PIL import Image
-from flask_socketio import emit
 
+from config import Config
 from utils.data_manager import DataManager
+from models.model_manager import model_manager
+
+try:
+    # libjpeg-turbo（SIMD 加速）直接解码为 numpy 数组，省去 PIL -> numpy 的复制
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+logger = logging.getLogger(__name__)
+
+def _b64_payload(data):
+    """
+    去掉 data URL 前缀（data:...;base64,），返回待 base64 解码的 memoryview
+    
+    str 只编码成 bytes 一次，之后切片不再复制；socketio 直接传来的 bytes 完全不复制
+    """
+    buf = data.encode('ascii') if isinstance(data, str) else data
+    view = memoryview(buf)
+    if buf[:5] == b'data:':
+        # 前缀很短，只在开头查找逗号
+        comma = buf.find(b',', 0, 256)
+        if comma < 0:
+            raise ValueError("data URL 缺少 base64 数据前的逗号")
+        view = view[comma + 1:]
+    return view
+
+def _decode_audio(data):
+    """
+    base64 音频数据（16位 PCM）-> int16 采样数组
+    
+    返回解码结果上的零拷贝只读视图；模型预处理需要 float32 时再一次性转换
+    （np.multiply(samples, 1 / 32768, dtype=np.float32)），中间不产生额外副本
+    """
+    audio_bytes = binascii.a2b_base64(_b64_payload(data))
+    return np.frombuffer(audio_bytes, dtype=np.int16, count=len(audio_bytes) // 2)
+
+def _compile_emotion_postprocess(keys, extra):
+    """
+    为固定的情绪类别生成直线代码的后处理函数：原始分数序列 -> 结果字典
+    
+    归一化、求最大值、构造字典都展开成逐项语句，没有中间字典、lambda 和第二遍遍历；
+    extra 为 ((键, 值), ...)，按顺序追加到结果字典末尾
+    """
+    n = len(keys)
+    lines = ['def postprocess(r):',
+             '    s = ' + ' + '.join(f'r[{i}]' for i in range(n))]
+    lines += [f'    e{i} = r[{i}] / s' for i in range(n)]
+    lines.append('    best, conf = 0, e0')
+    lines += [f'    if e{i} > conf: best, conf = {i}, e{i}' for i in range(1, n)]
+    emotions = ', '.join(f'{key!r}: e{i}' for i, key in enumerate(keys))
+    tail = ''.join(f', {k!r}: {v!r}' for k, v in extra)
+    lines.append(f"    return {{'emotions': {{{emotions}}}, 'dominant_emotion': KEYS[best], 'confidence': conf{tail}}}")
+    namespace = {'KEYS': tuple(keys)}
+    exec('\n'.join(lines), namespace)
+    return namespace['postprocess']
 
 class WebSocketHandler:
     """WebSocket事件处理器"""
     
+    # 每个会话排队等待处理的音频块上限（超出时丢弃最旧的）；视频帧只保留最新的一帧
+    MAX_PENDING_AUDIO = 8
+    
     def __init__(self, socketio):
         self.socketio = socketio
         self.data_manager = DataManager()
         self.active_sessions = {}
+        # 客户端 sid -> 该客户端的会话ID集合，断开连接时直接查找
+        self._sid_to_sessions = {}
+        self._jpeg = None
+        if TurboJPEG is not None:
+            try:
+                self._jpeg = TurboJPEG()
+            except Exception as e:
+                logger.warning("libturbojpeg 加载失败，使用PIL解码视频帧: %s", e)
+        # 模拟情绪分数的取值范围（每种情绪的上下界）
+        self._audio_keys = ('happy', 'sad', 'angry', 'neutral')
+        self._audio_lo = np.array([0.1, 0.1, 0.1, 0.2])
+        self._audio_hi = np.array([0.8, 0.6, 0.7, 0.9])
+        self._face_keys = ('happy', 'sad', 'angry', 'surprise', 'fear', 'disgust', 'neutral')
+        self._face_lo = np.array([0.1, 0.1, 0.1, 0.1, 0.05, 0.05, 0.1])
+        self._face_hi = np.array([0.9, 0.5, 0.6, 0.7, 0.4, 0.3, 0.8])
+        self._post_audio = _compile_emotion_postprocess(self._audio_keys, (('model', 'emotion2vec_mock'),))
+        self._post_face = _compile_emotion_postprocess(
+            self._face_keys, (('face_detected', True), ('model', 'deepface_mock')))
+        # 已处理的帧/音频块计数（多个工作线程共用，next() 在GIL下是原子的），每 EMPTY_CACHE_INTERVAL 次清理一次GPU缓存
+        self._frame_counter = itertools.count(1)
+        # 已观察到的帧尺寸；尺寸种类过多时关闭 cudnn.benchmark
+        self._observed_shapes = set()
+        # 各工作线程复用的帧缓冲（PIL 解码路径）
+        self._tls = threading.local()
+        # 解码和推理的工作线程；同一会话的任务经 _session_tasks 串行执行，结果按提交顺序写入和推送
+        self._pool = ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 4), thread_name_prefix='ws-infer')
+        atexit.register(self.cleanup)
+        # 会话ID -> 待执行任务队列 [(类型, 函数, 参数)]，有界：推理跟不上时丢弃过时的帧；不同会话之间并行
+        self._session_tasks = {}
+        self._tasks_lock = threading.Lock()
+        # 保护 active_sessions / _sid_to_sessions：会话结束与工作线程写入结果互斥，结束后的结果直接丢弃
+        self._sessions_lock = threading.Lock()
+    
+    def _after_inference(self):
+        """推理成功后计数，按 Config.EMPTY_CACHE_INTERVAL 周期性清理GPU缓存（无GPU时直接返回）"""
+        interval = Config.EMPTY_CACHE_INTERVAL
+        if interval <= 0:
+            return
+        gpu_manager = model_manager.get_gpu_manager()
+        if gpu_manager is None or not gpu_manager.gpu_available:
+            return
+        if next(self._frame_counter) % interval == 0:
+            gpu_manager.optimize_memory(log_level=logging.DEBUG)
     
     def handle_connect(self, sid):
         """处理客户端连接"""
-        print(f'客户端连接: {sid}')
-        emit('connected', {'message': '连接成功', 'sid': sid})
+        logger.info("客户端连接: %s", sid)
+        self.socketio.emit('connected', {'message': '连接成功', 'sid': sid}, to=sid, namespace='/')
     
     def handle_disconnect(self, sid):
         """处理客户端断开连接"""
-        print(f'客户端断开连接: {sid}')
+        logger.info("客户端断开连接: %s", sid)
         # 清理该客户端的会话信息
-        sessions_to_remove = []
-        for session_id, session_info in self.active_sessions.items():
-            if session_info.get('client_sid') == sid:
-                sessions_to_remove.append(session_id)
-        
-        for session_id in sessions_to_remove:
+        with self._sessions_lock:
+            session_ids = list(self._sid_to_sessions.get(sid, ()))
+        for session_id in session_ids:
             self.end_session(session_id)
     
     def start_session(self, session_id, client_sid):
         """开始新会话"""
         session_data = self.data_manager.create_session(session_id)
-        self.active_sessions[session_id] = {
-            'client_sid': client_sid,
-            'session_data': session_data
-        }
+        with self._sessions_lock:
+            previous = self.active_sessions.get(session_id)
+            if previous is not None:
+                self._unindex_session(session_id, previous['client_sid'])
+            self.active_sessions[session_id] = {
+                'client_sid': client_sid,
+                'session_data': session_data
+            }
+            self._sid_to_sessions.setdefault(client_sid, set()).add(session_id)
         return session_data
     
+    def _unindex_session(self, session_id, client_sid):
+        sessions = self._sid_to_sessions.get(client_sid)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._sid_to_sessions[client_sid]
+    
     def end_session(self, session_id):
-        """结束会话"""
-        if session_id in self.active_sessions:
-            self.data_manager.end_session(session_id)
-            del self.active_sessions[session_id]
+        """结束会话（先移出活跃会话，之后完成的推理结果不再写入）"""
+        with self._sessions_lock:
+            session_info = self.active_sessions.pop(session_id, None)
+            if session_info is None:
+                return False
+            self._unindex_session(session_id, session_info['client_sid'])
+        self.data_manager.end_session(session_id)
+        return True
+    
+    def _submit(self, session_id, kind, fn, *args):
+        """提交会话任务：同一会话的任务串行、按提交顺序执行
+
+        kind 为 'video' 时丢弃尚未开始处理的旧帧，只保留最新一帧；'audio' 最多排队 MAX_PENDING_AUDIO 块
+        """
+        with self._tasks_lock:
+            tasks = self._session_tasks.get(session_id)
+            if tasks is None:
+                self._session_tasks[session_id] = deque([(kind, fn, args)])
+            else:
+                if kind == 'video':
+                    stale = next((task for task in tasks if task[0] == 'video'), None)
+                else:
+                    pending = [task for task in tasks if task[0] == kind]
+                    stale = pending[0] if len(pending) >= self.MAX_PENDING_AUDIO else None
+                if stale is not None:
+                    tasks.remove(stale)
+                tasks.append((kind, fn, args))
+                return
+        self._pool.submit(self._drain_session, session_id)
+    
+    def _drain_session(self, session_id):
+        """工作线程：依次执行该会话排队的任务，队列取空后退出"""
+        while True:
+            with self._tasks_lock:
+                tasks = self._session_tasks.get(session_id)
+                if not tasks:
+                    self._session_tasks.pop(session_id, None)
+                    return
+                _, fn, args = tasks.popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                # 任务出错也要继续取队列，否则该会话后续任务永远不会执行
+                logger.exception("会话任务执行失败: %s", e)
+    
+    def _record_result(self, session_id, add, result):
+        """会话仍活跃时写入结果并返回 True；会话已结束时丢弃结果"""
+        with self._sessions_lock:
+            if session_id not in self.active_sessions:
+                return False
+            add(session_id, result)
             return True
-        return False
     
     def handle_audio_data(self, data, sid):
-        """处理音频数据"""
+        """处理音频数据（参数校验在当前线程，解码和推理按会话顺序交给线程池，结果按 sid 推送）"""
         try:
             session_id = data.get('session_id')
             audio_data = data.get('audio_data')
             
             if not session_id or session_id not in self.active_sessions:
-                emit('error', {'message': '无效的会话ID'})
+                self.socketio.emit('error', {'message': '无效的会话ID'}, to=sid, namespace='/')
                 return
             
             if not audio_data:
-                emit('error', {'message': '音频数据为空'})
+                self.socketio.emit('error', {'message': '音频数据为空'}, to=sid, namespace='/')
                 return
             
-            # 解码音频数据
-            try:
-                # 移除data URL前缀
-                if audio_data.startswith('data:'):
-                    audio_data = audio_data.split(',')[1]
-                
-                audio_bytes = base64.b64decode(audio_data)
-                
-                # TODO: 这里集成Emotion2Vec模型
-                # 目前使用模拟数据
-                emotion_result = self._analyze_audio_emotion(audio_bytes)
-                emotion_result['timestamp'] = datetime.now().isoformat()
-                
-                # 保存结果到数据库
-                self.data_manager.add_audio_emotion(session_id, emotion_result)
-                
-                # 发送结果给客户端
-                emit('audio_emotion_result', {
-                    'session_id': session_id,
-                    'result': emotion_result
-                })
-                
-            except Exception as e:
-                print(f"音频数据解码失败: {e}")
-                emit('error', {'message': '音频数据处理失败'})
+            self._submit(session_id, 'audio', self._process_audio_data, session_id, audio_data, sid)
                 
         except Exception as e:
-            print(f"处理音频数据时出错: {e}")
-            emit('error', {'message': '音频处理错误'})
+            logger.exception("处理音频数据时出错: %s", e)
+            self.socketio.emit('error', {'message': '音频处理错误'}, to=sid, namespace='/')
+    
+    def _process_audio_data(self, session_id, audio_data, sid):
+        """工作线程：解码音频数据并分析情绪"""
+        try:
+            # 移除data URL前缀并解码为采样数组
+            samples = _decode_audio(audio_data)
+            
+            # TODO: 这里集成Emotion2Vec模型
+            # 目前使用模拟数据
+            emotion_result = self._analyze_audio_emotion(samples)
+            emotion_result['timestamp'] = datetime.now().isoformat()
+            self._after_inference()
+            
+            # 保存结果到数据库（会话已结束则丢弃，不再推送）
+            if not self._record_result(session_id, self.data_manager.add_audio_emotion, emotion_result):
+                return
+            
+            # 发送结果给客户端
+            self.socketio.emit('audio_emotion_result', {
+                'session_id': session_id,
+                'result': emotion_result
+            }, to=sid, namespace='/')
+            
+        except Exception as e:
+            logger.exception("音频数据解码失败: %s", e)
+            self.socketio.emit('error', {'message': '音频数据处理失败'}, to=sid, namespace='/')
     
     def handle_video_frame(self, data, sid):
-        """处理视频帧数据"""
+        """处理视频帧数据（参数校验在当前线程，解码和推理按会话顺序交给线程池，结果按 sid 推送）"""
         try:
             session_id = data.get('session_id')
             frame_data = data.get('frame_data')
             
             if not session_id or session_id not in self.active_sessions:
-                emit('error', {'message': '无效的会话ID'})
+                self.socketio.emit('error', {'message': '无效的会话ID'}, to=sid, namespace='/')
                 return
             
             if not frame_data:
-                emit('error', {'message': '视频帧数据为空'})
+                self.socketio.emit('error', {'message': '视频帧数据为空'}, to=sid, namespace='/')
                 return
             
-            # 解码图像数据
-            try:
-                # 移除data URL前缀
-                if frame_data.startswith('data:'):
-                    frame_data = frame_data.split(',')[1]
+            self._submit(session_id, 'video', self._process_video_frame, session_id, frame_data, sid)
                 
-                image_bytes = base64.b64decode(frame_data)
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                # 转换为numpy数组
-                image_array = np.array(image)
-                
-                # TODO: 这里集成DeepFace模型
-                # 目前使用模拟数据
+        except Exception as e:
+            logger.exception("处理视频帧时出错: %s", e)
+            self.socketio.emit('error', {'message': '视频处理错误'}, to=sid, namespace='/')
+    
+    def _process_video_frame(self, session_id, frame_data, sid):
+        """工作线程：解码图像数据并分析面部情绪"""
+        try:
+            # 移除data URL前缀
+            image_bytes = binascii.a2b_base64(_b64_payload(frame_data))
+            image_array = self._decode_image(image_bytes)
+            self._observe_shape(image_array.shape)
+            
+            # TODO: 这里集成DeepFace模型
+            # 目前使用模拟数据；经GPU管理器执行，显存溢出时清空缓存重试
+            gpu_manager = model_manager.get_gpu_manager()
+            if gpu_manager is not None:
+                emotion_result = gpu_manager.run_with_oom_retry(
+                    lambda frames: [self._analyze_face_emotion(f) for f in frames], [image_array])[0]
+            else:
                 emotion_result = self._analyze_face_emotion(image_array)
-                emotion_result['timestamp'] = datetime.now().isoformat()
-                
-                # 保存结果到数据库
-                self.data_manager.add_video_emotion(session_id, emotion_result)
-                
-                # 发送结果给客户端
-                emit('video_emotion_result', {
-                    'session_id': session_id,
-                    'result': emotion_result
-                })
-                
-            except Exception as e:
-                print(f"视频帧解码失败: {e}")
-                emit('error', {'message': '视频帧处理失败'})
-                
+            emotion_result['timestamp'] = datetime.now().isoformat()
+            self._after_inference()
+            
+            # 保存结果到数据库（会话已结束则丢弃，不再推送）
+            if not self._record_result(session_id, self.data_manager.add_video_emotion, emotion_result):
+                return
+            
+            # 发送结果给客户端
+            self.socketio.emit('video_emotion_result', {
+                'session_id': session_id,
+                'result': emotion_result
+            }, to=sid, namespace='/')
+            
         except Exception as e:
-            print(f"处理视频帧时出错: {e}")
-            emit('error', {'message': '视频处理错误'})
+            logger.exception("视频帧解码失败: %s", e)
+            self.socketio.emit('error', {'message': '视频帧处理失败'}, to=sid, namespace='/')
+    
+    def _observe_shape(self, shape):
+        """记录帧尺寸，不同尺寸超过 Config.CUDNN_BENCHMARK_MAX_SHAPES 种时关闭 cudnn.benchmark（只触发一次）"""
+        shapes = self._observed_shapes
+        if shapes is None or shape in shapes:
+            return
+        shapes.add(shape)
+        if len(shapes) > Config.CUDNN_BENCHMARK_MAX_SHAPES:
+            self._observed_shapes = None
+            gpu_manager = model_manager.get_gpu_manager()
+            if gpu_manager is not None:
+                gpu_manager.disable_cudnn_benchmark(f"观察到 {len(shapes)} 种不同的帧尺寸")
     
-    def _analyze_audio_emotion(self, audio_bytes):
+    def _decode_image(self, image_bytes):
+        """解码图像为 RGB numpy 数组：JPEG 优先走 TurboJPEG，其他格式或解码失败时回退到PIL"""
+        if self._jpeg is not None and image_bytes[:2] == b'\xff\xd8':
+            try:
+                image_array = self._jpeg.decode(image_bytes, pixel_format=TJPF_RGB)
+            except Exception:
+                image_array = None
+            if image_array is not None:
+                return image_array
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        # asarray 直接包装 PIL 导出的像素数据（只读），不再像 np.array 那样额外复制一份
+        image_array = np.asarray(image)
+        # 复制到当前工作线程复用的缓冲中，避免每帧重新分配 H×W×3 的数组
+        buf = getattr(self._tls, 'frame_buf', None)
+        if buf is None or buf.shape != image_array.shape:
+            buf = self._tls.frame_buf = np.empty_like(image_array)
+        np.copyto(buf, image_array)
+        return buf
+    
+    def _analyze_audio_emotion(self, samples):
         """分析音频情绪（模拟实现）"""
         # TODO: 集成真实的Emotion2Vec模型
-        import random
-        
-        emotions = {
-            'happy': random.uniform(0.1, 0.8),
-            'sad': random.uniform(0.1, 0.6),
-            'angry': random.uniform(0.1, 0.7),
-            'neutral': random.uniform(0.2, 0.9)
-        }
-        
-        # 归一化
-        total = sum(emotions.values())
-        emotions = {k: v/total for k, v in emotions.items()}
-        
-        # 找到主导情绪
-        dominant_emotion = max(emotions.items(), key=lambda x: x[1])[0]
-        confidence = emotions[dominant_emotion]
-        
-        return {
-            'emotions': emotions,
-            'dominant_emotion': dominant_emotion,
-            'confidence': confidence,
-            'model': 'emotion2vec_mock'
-        }
+        # 一次生成全部情绪分数，归一化并找到主导情绪
+        return self._post_audio(np.random.uniform(self._audio_lo, self._audio_hi).tolist())
     
     def _analyze_face_emotion(self, image_array):
         """分析面部情绪（模拟实现）"""
         # TODO: 集成真实的DeepFace模型
-        import random
-        
         # 模拟面部检测
-        face_detected = random.choice([True, True, True, False])  # 75%概率检测到面部
+        face_detected = np.random.random() < 0.75  # 75%概率检测到面部
         
         if not face_detected:
             return {
@@ -186,47 +366,17 @@ class WebSocketHandler:
                 'model': 'deepface_mock'
             }
         
-        emotions = {
-            'happy': random.uniform(0.1, 0.9),
-            'sad': random.uniform(0.1, 0.5),
-            'angry': random.uniform(0.1, 0.6),
-            'surprise': random.uniform(0.1, 0.7),
-            'fear': random.uniform(0.05, 0.4),
-            'disgust': random.uniform(0.05, 0.3),
-            'neutral': random.uniform(0.1, 0.8)
-        }
-        
-        # 归一化
-        total = sum(emotions.values())
-        emotions = {k: v/total for k, v in emotions.items()}
-        
-        # 找到主导情绪
-        dominant_emotion = max(emotions.items(), key=lambda x: x[1])[0]
-        confidence = emotions[dominant_emotion]
-        
-        return {
-            'emotions': emotions,
-            'dominant_emotion': dominant_emotion,
-            'confidence': confidence,
-            'face_detected': True,
-            'model': 'deepface_mock'
-        }
+        # 一次生成全部情绪分数，归一化并找到主导情绪
+        return self._post_face(np.random.uniform(self._face_lo, self._face_hi).tolist())
     
     def get_session_status(self, session_id):
-        """获取会话状态"""
-        if session_id in self.active_sessions:
+        """获取会话状态（会话数据取 DataManager 中的最新副本）"""
+        session_data = self.data_manager.load_session(session_id)
+        if session_data:
             return {
-                'active': True,
-                'session_data': self.active_sessions[session_id]['session_data']
+                'active': session_id in self.active_sessions,
+                'session_data': session_data
             }
-        else:
-            # 尝试从文件加载
-            session_data = self.data_manager.load_session(session_id)
-            if session_data:
-                return {
-                    'active': False,
-                    'session_data': session_data
-                }
         
         return None
     
@@ -234,7 +384,13 @@ class WebSocketHandler:
         """向特定会话广播消息"""
         if session_id in self.active_sessions:
             client_sid = self.active_sessions[session_id]['client_sid']
-            self.socketio.emit(event, data, room=client_sid)
+            self.socketio.emit(event, data, to=client_sid, namespace='/')
+    
+    def cleanup(self):
+        """关闭解码和推理线程池，丢弃尚未处理的任务"""
+        with self._tasks_lock:
+            self._session_tasks.clear()
+        self._pool.shutdown(wait=False)
     
     def get_active_sessions_count(self):
         """获取活跃会话数量"""